@@ -1,28 +1,70 @@
 #!/usr/bin/env python3
-from flask import Flask, render_template, redirect, url_for, session
+from flask import Flask, render_template, redirect, session
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from flask_compress import Compress
 from dotenv import load_dotenv
+import orjson
 import os
 
 # Load environment variables
 load_dotenv()
 
+def _json_default(obj):
+    # Neo4j temporal values (created_at, timestamp, ...) carry their own ISO formatter
+    if hasattr(obj, 'iso_format'):
+        return obj.iso_format()
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson, which encodes datetimes and NumPy values natively"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(
+            obj, default=_json_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        ).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 def create_app():
     app = Flask(__name__, template_folder='app/templates', static_folder='app/static')
     app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'dev-key-change-in-production')
+    app.json = OrjsonProvider(app)
     
     # Enable CORS
     CORS(app)
     
+    # Gzip/brotli responses worth compressing; Flask-Compress adds Vary: Accept-Encoding
+    app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+    Compress(app)
+    
     # Initialize database connection
-    from app.models.database import Neo4jDB
-    app.db = Neo4jDB()
+    from app.models.database import get_db
+    app.db = get_db()
+    app.db.ensure_indexes()
+    
+    # Models and engines only hold the db handle, so one instance serves every request
+    from app.models.course import Course
+    from app.models.user import User
+    from app.models.ai_engine import AILearningEngine
+    from app.models.gamification import GamificationEngine
+    from app.models.collaboration import CollaborationEngine
+    app.course_model = Course(app.db)
+    app.user_model = User(app.db)
+    app.ai_engine = AILearningEngine(app.db)
+    app.gamification = GamificationEngine(app.db)
+    app.collaboration = CollaborationEngine(app.db)
     
     # Register blueprints
-    from app.routes.auth import auth_bp
+    from app.routes.auth import auth_bp, limiter, static_url
     from app.routes.course import course_bp
     from app.routes.api import api_bp
     
+    limiter.init_app(app)
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(course_bp, url_prefix='/course')
     app.register_blueprint(api_bp, url_prefix='/api')
@@ -30,19 +72,19 @@ def create_app():
     @app.route('/')
     def index():
         if 'user_id' not in session:
-            return redirect(url_for('auth.login'))
+            return redirect(static_url('auth.login'))
         return render_template('dashboard.html')
     
     @app.route('/graph')
     def graph_view():
         if 'user_id' not in session:
-            return redirect(url_for('auth.login'))
+            return redirect(static_url('auth.login'))
         return render_template('graph.html')
     
     @app.route('/leaderboard')
     def leaderboard():
         if 'user_id' not in session:
-            return redirect(url_for('auth.login'))
+            return redirect(static_url('auth.login'))
         return render_template('leaderboard.html')
     
     return app
@@ -50,9 +92,12 @@ def create_app():
 if __name__ == '__main__':
     app = create_app()
     
-    # Initialize sample data
-    print("🚀 Initializing MIT Statistics course data...")
-    app.db.create_sample_course()
+    # Initialize sample data unless a previous run already seeded the graph
+    if os.getenv('SAMPLE_DATA_LOADED') == '1' or app.db.has_sample_course():
+        print("✅ MIT Statistics course data already loaded")
+    else:
+        print("🚀 Initializing MIT Statistics course data...")
+        app.db.create_sample_course()
     
     print("🌟 Starting Neo4j Learning Platform...")
     app.run(host='0.0.0.0', port=5000, debug=True)
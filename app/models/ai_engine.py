@@ -2,48 +2,243 @@
 AI-Powered Learning Engine
 Advanced algorithms for personalized learning optimization
 """
-import random
 import json
+import threading
+import zlib
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Dict, List, Any, Tuple
 import numpy as np
+from cachetools import TTLCache
+
+_DIFFICULTY_CODES = {'Beginner': 0, 'Intermediate': 1, 'Advanced': 2}
+_UNKNOWN_DIFFICULTY = 255
+
+# Learning style per quick-completion band; the middle band is mixed
+_STYLE_BANDS = ('kinesthetic', None, 'visual')
+_MIXED_STYLES = ('auditory', 'reading')
+
+# Personalized content templates, keyed by learning style
+_EXPLANATION_FORMATS = {
+    'visual': "🎯 {name}: Visual learners excel with diagrams and charts. This {difficulty} concept builds on your visual processing strengths.",
+    'auditory': "🎵 {name}: As an auditory learner, you'll master this {difficulty} concept through discussion and verbal explanation.",
+    'kinesthetic': "🤲 {name}: Hands-on practice will help you master this {difficulty} concept through active engagement.",
+    'reading': "📚 {name}: Deep reading and written analysis will help you excel with this {difficulty} concept."
+}
+
+_STUDY_TIPS = {
+    'visual': (
+        "Create mind maps and flowcharts",
+        "Use color-coded notes",
+        "Draw concept relationships",
+        "Watch video demonstrations"
+    ),
+    'auditory': (
+        "Read concepts aloud",
+        "Join study groups",
+        "Use mnemonic devices",
+        "Listen to explanatory podcasts"
+    ),
+    'kinesthetic': (
+        "Work through practice problems",
+        "Use physical manipulatives",
+        "Take frequent breaks",
+        "Apply concepts to real scenarios"
+    ),
+    'reading': (
+        "Take detailed written notes",
+        "Summarize key points",
+        "Create written explanations",
+        "Use textbook resources"
+    )
+}
+
+_PRACTICE_TYPES = {
+    'visual': 'interactive_visualization',
+    'auditory': 'verbal_explanation',
+    'kinesthetic': 'hands_on_practice',
+    'reading': 'written_analysis'
+}
+
+def _stable_seed(user_id: str) -> int:
+    """Per-user seed that, unlike hash(), is identical across worker processes"""
+    return zlib.crc32(user_id.encode('utf-8'))
+
+def _style_for(quick_ratio: float, user_id: str) -> str:
+    """Map the share of first-attempt completions onto a learning style"""
+    # Quick visual learners above 0.7, kinesthetic learners who need more
+    # practice below 0.3, and a mixed band settled per user, not at random
+    style = _STYLE_BANDS[int(quick_ratio >= 0.3) + int(quick_ratio > 0.7)]
+    return style if style is not None else _MIXED_STYLES[_stable_seed(user_id) & 1]
+
+# The pure profile rules below depend only on the history counts
+# (n, sum_attempts, quick, beginner, intermediate, advanced), which are
+# hashable, so repeat profile builds for an unchanged history are lookups.
+
+@lru_cache(maxsize=4096)
+def _pace(counts: Tuple[int, ...]) -> str:
+    """Predict optimal learning pace"""
+    
+    n, sum_attempts = counts[0], counts[1]
+    if not n:
+        return 'moderate'
+    
+    avg_attempts = sum_attempts / n
+    
+    if avg_attempts < 1.5:
+        return 'fast'
+    elif avg_attempts > 2.5:
+        return 'slow'
+    else:
+        return 'moderate'
+
+@lru_cache(maxsize=4096)
+def _difficulty_pref(counts: Tuple[int, ...]) -> str:
+    """Analyze user's difficulty preference"""
+    
+    n, advanced = counts[0], counts[5]
+    if not n:
+        return 'progressive'
+    
+    advanced_ratio = advanced / n
+    
+    if advanced_ratio > 0.5:
+        return 'challenging'
+    elif advanced_ratio < 0.2:
+        return 'gentle'
+    else:
+        return 'progressive'
+
+@lru_cache(maxsize=4096)
+def _session_length(counts: Tuple[int, ...]) -> int:
+    """Recommend optimal session length in minutes"""
+    
+    n, sum_attempts = counts[0], counts[1]
+    if not n:
+        return 30
+    
+    # Analyze completion patterns
+    avg_attempts = sum_attempts / n
+    
+    if avg_attempts < 1.5:
+        return 45  # Can handle longer sessions
+    elif avg_attempts > 2.5:
+        return 20  # Shorter focused sessions
+    else:
+        return 30
+
+_Q_HISTORY = '''
+    MATCH (u:User {id: $user_id})-[r:COMPLETED]->(c:Concept)
+    RETURN c.id as concept_id, c.difficulty as difficulty, 
+           r.completion_time as time, r.attempts as attempts,
+           r.timestamp as timestamp
+    ORDER BY r.timestamp DESC
+'''
+
+_Q_AVAILABLE_CONCEPTS = '''
+    MATCH (c:Concept)
+    WHERE c.name IS NOT NULL
+      AND NOT EXISTS { MATCH (:User {id: $user_id})-[:COMPLETED]->(c) }
+      AND ALL(prereq IN [(p:Concept)-[:PREREQUISITE_FOR]->(c) | p]
+              WHERE EXISTS { MATCH (:User {id: $user_id})-[:COMPLETED]->(prereq) })
+    RETURN c.id as id, c.name as name, c.difficulty as difficulty,
+           false as completed
+'''
+
+_Q_STYLE_COUNTS = '''
+    MATCH (u:User {id: $user_id})-[r:COMPLETED]->()
+    RETURN count(r) as total,
+           sum(CASE WHEN r.attempts = 1 THEN 1 ELSE 0 END) as quick
+'''
+
+_Q_CONCEPT = '''
+    MATCH (c:Concept {id: $concept_id})
+    RETURN c.name as name, c.difficulty as difficulty
+'''
+
+_Q_MASTERY_INTERACTIONS = '''
+    MATCH (u:User {id: $user_id})-[r:INTERACTED_WITH]->(c:Concept)
+    WHERE c.id IN $concept_ids
+    RETURN c.id as id, coalesce(r.time_spent, 0) as time_spent,
+           coalesce(r.attempts, 1) as attempts,
+           coalesce(r.correct_answers, 0) as correct,
+           coalesce(r.total_questions, 1) as total
+'''
+
+_Q_WEEKLY_ACTIVITY = '''
+    MATCH (u:User {id: $user_id})-[r:COMPLETED]->(:Concept)
+    WHERE r.timestamp >= datetime.truncate('day', datetime()) - duration('P6D')
+    RETURN duration.inDays(date(r.timestamp), date()).days as days_ago,
+           count(*) as completed,
+           sum(coalesce(r.completion_time, 0)) as minutes
+'''
 
 class AILearningEngine:
+    # Learning profiles are shared by every engine instance so repeated reads
+    # within (and across) requests skip the history query
+    _profile_cache = TTLCache(maxsize=10_000, ttl=60)
+    _profile_lock = threading.Lock()
+    
     def __init__(self, db):
         self.db = db
         self.learning_styles = ['visual', 'auditory', 'kinesthetic', 'reading']
         self.difficulty_weights = {'Beginner': 1.0, 'Intermediate': 1.5, 'Advanced': 2.0}
         
+    @classmethod
+    def invalidate(cls, user_id: str):
+        """Drop the cached learning profile after the user's history changes"""
+        with cls._profile_lock:
+            cls._profile_cache.pop(user_id, None)
+    
     def analyze_learning_pattern(self, user_id: str) -> Dict[str, Any]:
         """Analyze user's learning patterns using AI algorithms"""
         
-        # Get user's learning history
-        history = self.db.execute_query('''
-            MATCH (u:User {id: $user_id})-[r:COMPLETED]->(c:Concept)
-            RETURN c.id as concept_id, c.difficulty as difficulty, 
-                   r.completion_time as time, r.attempts as attempts,
-                   r.timestamp as timestamp
-            ORDER BY r.timestamp DESC
-        ''', {'user_id': user_id})
+        profile = self._cached_profile(user_id)
+        
+        if profile is None:
+            profile = self._build_learning_profile(self._query_history(user_id), user_id)
+            self._remember_profile(user_id, profile)
+        
+        # Callers decorate the profile, so hand out a copy
+        return dict(profile)
+    
+    def _cached_profile(self, user_id: str) -> Dict[str, Any]:
+        with self._profile_lock:
+            return self._profile_cache.get(user_id)
+    
+    def _remember_profile(self, user_id: str, profile: Dict[str, Any]):
+        with self._profile_lock:
+            self._profile_cache[user_id] = profile
+    
+    def _query_history(self, user_id: str) -> List[Dict[str, Any]]:
+        """Get user's learning history, most recent first"""
+        return self.db.cached_query(_Q_HISTORY, {'user_id': user_id}, tag=user_id)
+    
+    def _build_learning_profile(self, history: List[Dict[str, Any]], user_id: str) -> Dict[str, Any]:
+        """Compute the learning profile from the user's completion history"""
+        
+        # Every time-based metric is measured against the same instant
+        now = datetime.now()
         
         if not history:
-            return self._default_learning_profile()
+            return self._default_learning_profile(now)
         
-        # Calculate learning metrics
-        total_concepts = len(history)
-        avg_attempts = sum(h.get('attempts', 1) or 1 for h in history) / total_concepts if total_concepts > 0 else 1
+        # Calculate learning metrics in a single pass over the history
+        summary = self._summarize_history(history)
+        total_concepts = summary['n']
+        avg_attempts = float(summary['attempts'].mean())
         
         # Determine learning style based on performance patterns
-        learning_style = self._detect_learning_style(history)
+        learning_style = self._detect_learning_style(summary, user_id)
         
         # Calculate knowledge retention score
-        retention_score = self._calculate_retention_score(history)
+        retention_score = self._calculate_retention_score(summary, now)
         
         # Predict optimal learning pace
-        optimal_pace = self._predict_learning_pace(history)
+        optimal_pace = _pace(summary['counts'])
         
         # Generate difficulty preference
-        difficulty_preference = self._analyze_difficulty_preference(history)
+        difficulty_preference = _difficulty_pref(summary['counts'])
         
         return {
             'learning_style': learning_style,
@@ -53,52 +248,58 @@ class AILearningEngine:
             'avg_attempts': avg_attempts,
             'total_concepts_completed': total_concepts,
             'confidence_level': min(retention_score * 100, 95),
-            'recommended_session_length': self._recommend_session_length(history),
-            'next_optimal_study_time': self._predict_next_study_time(history)
+            'recommended_session_length': _session_length(summary['counts']),
+            'next_optimal_study_time': self._predict_next_study_time(summary, now)
         }
     
     def generate_adaptive_path(self, user_id: str) -> List[Dict[str, Any]]:
         """Generate AI-optimized learning path based on user's profile"""
         
-        profile = self.analyze_learning_pattern(user_id)
-        
-        # Get all available concepts
-        concepts = self.db.execute_query('''
-            MATCH (c:Concept)
-            WHERE c.name IS NOT NULL
-            OPTIONAL MATCH (u:User {id: $user_id})-[comp:COMPLETED]->(c)
-            RETURN c.id as id, c.name as name, c.difficulty as difficulty,
-                   comp IS NOT NULL as completed
-        ''', {'user_id': user_id})
-        
-        # Get prerequisite relationships
-        prereqs = self.db.execute_query('''
-            MATCH (c1:Concept)-[:PREREQUISITE_FOR]->(c2:Concept)
-            RETURN c1.id as prereq, c2.id as concept
-        ''')
-        
-        # Build prerequisite map
-        prereq_map = {}
-        for p in prereqs:
-            if p['concept'] not in prereq_map:
-                prereq_map[p['concept']] = []
-            prereq_map[p['concept']].append(p['prereq'])
+        profile = self._cached_profile(user_id)
+        
+        if profile is None:
+            # The history and concept queries are independent, so overlap them
+            history, available = self.db.run_concurrently(
+                lambda: self._query_history(user_id),
+                lambda: self._query_available_concepts(user_id)
+            )
+            profile = self._build_learning_profile(history, user_id)
+            self._remember_profile(user_id, profile)
+        else:
+            available = self._query_available_concepts(user_id)
         
         # AI-powered path optimization
-        optimized_path = self._optimize_learning_path(concepts, prereq_map, profile)
+        optimized_path = self._optimize_learning_path(available, profile, user_id)
         
         return optimized_path
     
+    def _query_available_concepts(self, user_id: str) -> List[Dict[str, Any]]:
+        """Get the concepts whose prerequisites the user has all completed"""
+        return self.db.cached_query(_Q_AVAILABLE_CONCEPTS, {'user_id': user_id}, tag=user_id)
+    
+    def get_learning_style(self, user_id: str) -> str:
+        """Detect the user's learning style without building the full profile"""
+        
+        profile = self._cached_profile(user_id)
+        if profile is not None:
+            return profile['learning_style']
+        
+        # Only two counts drive the style, so let Neo4j aggregate them
+        counts = self.db.cached_query(_Q_STYLE_COUNTS, {'user_id': user_id}, tag=user_id)
+        
+        total = counts[0]['total'] if counts else 0
+        if not total:
+            return 'visual'
+        
+        return _style_for(counts[0]['quick'] / total, user_id)
+    
     def generate_personalized_content(self, concept_id: str, user_id: str) -> Dict[str, Any]:
         """Generate AI-personalized learning content"""
         
-        profile = self.analyze_learning_pattern(user_id)
+        profile = {'learning_style': self.get_learning_style(user_id)}
         
         # Get concept details
-        concept = self.db.execute_query('''
-            MATCH (c:Concept {id: $concept_id})
-            RETURN c.name as name, c.difficulty as difficulty
-        ''', {'concept_id': concept_id})
+        concept = self.db.cached_query(_Q_CONCEPT, {'concept_id': concept_id}, ttl=300, tag='concepts')
         
         if not concept:
             return {}
@@ -113,29 +314,59 @@ class AILearningEngine:
     def calculate_mastery_score(self, user_id: str, concept_id: str) -> float:
         """Calculate AI-based mastery score for a concept"""
         
+        return self.calculate_mastery_scores(user_id, [concept_id])[concept_id]
+    
+    def calculate_mastery_scores(self, user_id: str, concept_ids: List[str]) -> Dict[str, float]:
+        """Calculate AI-based mastery scores for several concepts in one query"""
+        
         # Get user's interaction data
-        interactions = self.db.execute_query('''
-            MATCH (u:User {id: $user_id})-[r:INTERACTED_WITH]->(c:Concept {id: $concept_id})
-            RETURN r.time_spent as time_spent, r.attempts as attempts,
-                   r.correct_answers as correct, r.total_questions as total
-        ''', {'user_id': user_id, 'concept_id': concept_id})
+        interactions = self.db.execute_read(_Q_MASTERY_INTERACTIONS, {
+            'user_id': user_id, 'concept_ids': list(concept_ids)
+        })
+        
+        scores = dict.fromkeys(concept_ids, 0.0)
         
         if not interactions:
-            return 0.0
+            return scores
+        
+        # One interaction per concept is scored, first match wins
+        rows = {}
+        for interaction in interactions:
+            rows.setdefault(interaction['id'], interaction)
+        rows = list(rows.values())
         
-        interaction = interactions[0]
+        time_spent = np.array([r['time_spent'] for r in rows], dtype=np.float64)
+        attempts = np.array([r['attempts'] for r in rows], dtype=np.float64)
+        correct = np.array([r['correct'] for r in rows], dtype=np.float64)
+        total = np.array([r['total'] for r in rows], dtype=np.float64)
         
         # AI mastery calculation
-        time_factor = min(interaction.get('time_spent', 0) / 300, 1.0)  # 5 min optimal
-        accuracy = interaction.get('correct', 0) / max(interaction.get('total', 1), 1)
-        attempt_penalty = max(0, 1 - (interaction.get('attempts', 1) - 1) * 0.1)
+        time_factor = np.minimum(time_spent / 300, 1.0)  # 5 min optimal
+        accuracy = correct / np.maximum(total, 1)
+        attempt_penalty = np.maximum(0, 1 - (attempts - 1) * 0.1)
         
-        mastery_score = (accuracy * 0.6 + time_factor * 0.2 + attempt_penalty * 0.2) * 100
+        mastery_scores = np.minimum((accuracy * 0.6 + time_factor * 0.2 + attempt_penalty * 0.2) * 100, 100)
         
-        return min(mastery_score, 100)
+        scores.update(zip((r['id'] for r in rows), mastery_scores.tolist()))
+        return scores
     
-    def _default_learning_profile(self) -> Dict[str, Any]:
+    def get_weekly_activity(self, user_id: str) -> Dict[str, List[int]]:
+        """Completions and minutes studied per day over the last week, oldest day first"""
+        
+        rows = self.db.cached_query(_Q_WEEKLY_ACTIVITY, {'user_id': user_id}, tag=user_id)
+        
+        completed = [0] * 7
+        minutes = [0] * 7
+        for row in rows:
+            if 0 <= row['days_ago'] < 7:
+                completed[6 - row['days_ago']] = row['completed']
+                minutes[6 - row['days_ago']] = int(row['minutes'])
+        
+        return {'weekly_progress': completed, 'time_spent_daily': minutes}
+    
+    def _default_learning_profile(self, now: datetime = None) -> Dict[str, Any]:
         """Default learning profile for new users"""
+        now = now or datetime.now()
         return {
             'learning_style': 'visual',
             'retention_score': 0.7,
@@ -145,164 +376,154 @@ class AILearningEngine:
             'total_concepts_completed': 0,
             'confidence_level': 50,
             'recommended_session_length': 30,
-            'next_optimal_study_time': datetime.now() + timedelta(hours=24)
+            'next_optimal_study_time': now + timedelta(hours=24)
         }
     
-    def _detect_learning_style(self, history: List[Dict]) -> str:
-        """AI algorithm to detect learning style from interaction patterns"""
-        
-        # Analyze completion patterns
-        quick_completions = sum(1 for h in history if h.get('attempts', 1) == 1)
-        total = len(history)
+    def _summarize_history(self, history: List[Dict]) -> Dict[str, Any]:
+        """Collect the history columns every profile metric is derived from"""
+        
+        attempts = []
+        quick = []
+        difficulty = []
+        timestamps = []
+        
+        for h in history:
+            raw_attempts = h.get('attempts', 1)
+            # A null attempt count averages as 1 but is not a quick completion
+            attempts.append(raw_attempts or 1)
+            quick.append(raw_attempts == 1)
+            difficulty.append(_DIFFICULTY_CODES.get(h.get('difficulty', 'Beginner'), _UNKNOWN_DIFFICULTY))
+            timestamps.append(h.get('timestamp'))
+        
+        attempts = np.array(attempts, dtype=np.int32)
+        quick = np.array(quick, dtype=np.bool_)
+        difficulty = np.array(difficulty, dtype=np.uint8)
         
-        if quick_completions / total > 0.7:
-            return 'visual'  # Quick visual learners
-        elif quick_completions / total < 0.3:
-            return 'kinesthetic'  # Need more practice
-        else:
-            return random.choice(['auditory', 'reading'])
+        return {
+            'n': len(history),
+            'attempts': attempts,
+            'quick': quick,
+            'difficulty': difficulty,
+            'timestamps': timestamps,
+            'counts': (
+                len(history),
+                int(attempts.sum()),
+                int(quick.sum()),
+                *(int((difficulty == code).sum()) for code in _DIFFICULTY_CODES.values())
+            )
+        }
     
-    def _calculate_retention_score(self, history: List[Dict]) -> float:
+    def _detect_learning_style(self, summary: Dict[str, Any], user_id: str) -> str:
+        """AI algorithm to detect learning style from interaction patterns"""
+        return _style_for(float(summary['quick'].mean()), user_id)
+    
+    def _calculate_retention_score(self, summary: Dict[str, Any], now: datetime = None) -> float:
         """Calculate knowledge retention using spaced repetition principles"""
         
-        if not history:
+        if not summary['n']:
             return 0.5
         
         # Simulate retention decay over time
-        now = datetime.now()
-        retention_sum = 0
-        
-        for item in history:
-            timestamp = item.get('timestamp')
-            if timestamp:
-                try:
-                    days_ago = (now - datetime.fromisoformat(timestamp)).days
-                    retention = np.exp(-days_ago / 7)  # Exponential decay
-                    retention_sum += retention
-                except (ValueError, TypeError):
-                    # If timestamp parsing fails, assume recent
-                    retention_sum += 0.8
-            else:
-                # No timestamp, assume recent
-                retention_sum += 0.8
-        
-        return min(retention_sum / len(history), 1.0)
-    
-    def _predict_learning_pace(self, history: List[Dict]) -> str:
-        """Predict optimal learning pace"""
-        
-        if not history:
-            return 'moderate'
-        
-        avg_attempts = sum(h.get('attempts', 1) or 1 for h in history) / len(history)
-        
-        if avg_attempts < 1.5:
-            return 'fast'
-        elif avg_attempts > 2.5:
-            return 'slow'
-        else:
-            return 'moderate'
-    
-    def _analyze_difficulty_preference(self, history: List[Dict]) -> str:
-        """Analyze user's difficulty preference"""
-        
-        if not history:
-            return 'progressive'
-        
-        difficulties = [h.get('difficulty', 'Beginner') for h in history]
-        advanced_ratio = difficulties.count('Advanced') / len(difficulties)
-        
-        if advanced_ratio > 0.5:
-            return 'challenging'
-        elif advanced_ratio < 0.2:
-            return 'gentle'
-        else:
-            return 'progressive'
+        now = now or datetime.now()
+        elapsed = np.fromiter(
+            (self._seconds_since(timestamp, now) for timestamp in summary['timestamps']),
+            dtype=np.float64, count=summary['n']
+        )
+        
+        days_ago = np.floor(elapsed / 86400)
+        retention = np.exp(-days_ago / 7)  # Exponential decay
+        # If the timestamp is missing or unparseable, assume recent
+        retention[np.isnan(elapsed)] = 0.8
+        
+        return float(min(retention.mean(), 1.0))
     
-    def _recommend_session_length(self, history: List[Dict]) -> int:
-        """Recommend optimal session length in minutes"""
-        
-        if not history:
-            return 30
-        
-        # Analyze completion patterns
-        avg_attempts = sum(h.get('attempts', 1) or 1 for h in history) / len(history)
-        
-        if avg_attempts < 1.5:
-            return 45  # Can handle longer sessions
-        elif avg_attempts > 2.5:
-            return 20  # Shorter focused sessions
-        else:
-            return 30
+    @staticmethod
+    def _seconds_since(timestamp: Any, now: datetime) -> float:
+        """Seconds elapsed since a Neo4j DateTime or ISO timestamp, NaN if it can't be read"""
+        
+        try:
+            # Native Cypher datetimes come back as neo4j.time.DateTime; older rows hold ISO strings
+            if hasattr(timestamp, 'to_native'):
+                timestamp = timestamp.to_native()
+            elif not isinstance(timestamp, datetime):
+                timestamp = datetime.fromisoformat(timestamp)
+            
+            # Naive values are local time; make both sides aware before subtracting
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.astimezone()
+            if now.tzinfo is None:
+                now = now.astimezone()
+            return (now - timestamp).total_seconds()
+        except (ValueError, TypeError, OverflowError):
+            return np.nan
     
-    def _predict_next_study_time(self, history: List[Dict]) -> datetime:
+    def _predict_next_study_time(self, summary: Dict[str, Any], now: datetime = None) -> datetime:
         """Predict optimal next study time using AI"""
         
-        if not history:
-            return datetime.now() + timedelta(hours=24)
+        now = now or datetime.now()
+        
+        if not summary['n']:
+            return now + timedelta(hours=24)
         
         # Simple spaced repetition algorithm
-        timestamp = history[0].get('timestamp')
-        if timestamp:
-            try:
-                last_study = datetime.fromisoformat(timestamp)
-                days_since = (datetime.now() - last_study).days
-            except (ValueError, TypeError):
-                days_since = 0
-        else:
-            days_since = 0
+        elapsed = self._seconds_since(summary['timestamps'][0], now)
+        days_since = 0 if np.isnan(elapsed) else elapsed // 86400
         
         if days_since < 1:
-            return datetime.now() + timedelta(hours=12)
+            return now + timedelta(hours=12)
         elif days_since < 3:
-            return datetime.now() + timedelta(days=1)
+            return now + timedelta(days=1)
         else:
-            return datetime.now() + timedelta(hours=6)  # Time to review!
+            return now + timedelta(hours=6)  # Time to review!
     
-    def _optimize_learning_path(self, concepts: List[Dict], prereq_map: Dict, profile: Dict) -> List[Dict]:
-        """AI-powered learning path optimization"""
+    def _optimize_learning_path(self, available: List[Dict], profile: Dict, user_id: str) -> List[Dict]:
+        """AI-powered learning path optimization over the unlocked concepts"""
         
-        completed = [c for c in concepts if c['completed']]
-        available = []
-        
-        for concept in concepts:
-            if concept['completed']:
-                continue
-            
-            # Check if prerequisites are met
-            prereqs = prereq_map.get(concept['id'], [])
-            if all(any(c['id'] == p and c['completed'] for c in concepts) for p in prereqs):
-                available.append(concept)
+        if not available:
+            return []
         
         # AI scoring for path optimization
-        scored_concepts = []
-        for concept in available:
-            score = self._calculate_concept_score(concept, profile)
-            scored_concepts.append({
-                **concept,
-                'ai_score': score,
-                'estimated_time': self._estimate_completion_time(concept, profile),
-                'mastery_prediction': self._predict_mastery_success(concept, profile)
-            })
-        
-        # Sort by AI score
-        scored_concepts.sort(key=lambda x: x['ai_score'], reverse=True)
-        
-        return scored_concepts[:5]  # Top 5 recommendations
-    
-    def _calculate_concept_score(self, concept: Dict, profile: Dict) -> float:
-        """Calculate AI score for concept recommendation"""
-        
-        difficulty_match = 1.0
-        if profile['difficulty_preference'] == 'challenging' and concept['difficulty'] == 'Advanced':
-            difficulty_match = 1.5
-        elif profile['difficulty_preference'] == 'gentle' and concept['difficulty'] == 'Beginner':
-            difficulty_match = 1.3
+        scores = self._score_concepts(available, profile, seed=_stable_seed(user_id))
+        
+        # Top 5 recommendations by AI score
+        top = np.argsort(-scores, kind='stable')[:5]
+        
+        return [
+            {
+                **available[i],
+                'ai_score': float(scores[i]),
+                'estimated_time': self._estimate_completion_time(available[i], profile),
+                'mastery_prediction': self._predict_mastery_success(available[i], profile)
+            }
+            for i in top
+        ]
+    
+    def _score_concepts(self, concepts: List[Dict], profile: Dict, seed: int = None) -> np.ndarray:
+        """Calculate AI scores for a batch of concept recommendations
+        
+        Scores are jittered only when a seed is given, so a user's path is
+        reproducible for the same profile and concepts.
+        """
+        
+        difficulty = np.fromiter(
+            (_DIFFICULTY_CODES.get(c['difficulty'], _UNKNOWN_DIFFICULTY) for c in concepts),
+            dtype=np.uint8, count=len(concepts)
+        )
+        
+        difficulty_match = np.ones(len(concepts))
+        if profile['difficulty_preference'] == 'challenging':
+            difficulty_match[difficulty == _DIFFICULTY_CODES['Advanced']] = 1.5
+        elif profile['difficulty_preference'] == 'gentle':
+            difficulty_match[difficulty == _DIFFICULTY_CODES['Beginner']] = 1.3
         
         confidence_factor = profile['confidence_level'] / 100
         pace_factor = 1.2 if profile['optimal_pace'] == 'fast' else 1.0
+        scores = difficulty_match * confidence_factor * pace_factor
         
-        return difficulty_match * confidence_factor * pace_factor * random.uniform(0.8, 1.2)
+        if seed is not None:
+            scores *= np.random.default_rng(seed).uniform(0.8, 1.2, size=len(concepts))
+        
+        return scores
     
     def _estimate_completion_time(self, concept: Dict, profile: Dict) -> int:
         """Estimate completion time in minutes"""
@@ -334,49 +555,13 @@ class AILearningEngine:
         """Generate personalized content based on learning style"""
         
         learning_style = profile['learning_style']
-        difficulty = concept['difficulty']
-        
-        content_templates = {
-            'visual': {
-                'explanation': f"🎯 {concept['name']}: Visual learners excel with diagrams and charts. This {difficulty.lower()} concept builds on your visual processing strengths.",
-                'study_tips': [
-                    "Create mind maps and flowcharts",
-                    "Use color-coded notes",
-                    "Draw concept relationships",
-                    "Watch video demonstrations"
-                ],
-                'practice_type': 'interactive_visualization'
-            },
-            'auditory': {
-                'explanation': f"🎵 {concept['name']}: As an auditory learner, you'll master this {difficulty.lower()} concept through discussion and verbal explanation.",
-                'study_tips': [
-                    "Read concepts aloud",
-                    "Join study groups",
-                    "Use mnemonic devices",
-                    "Listen to explanatory podcasts"
-                ],
-                'practice_type': 'verbal_explanation'
-            },
-            'kinesthetic': {
-                'explanation': f"🤲 {concept['name']}: Hands-on practice will help you master this {difficulty.lower()} concept through active engagement.",
-                'study_tips': [
-                    "Work through practice problems",
-                    "Use physical manipulatives",
-                    "Take frequent breaks",
-                    "Apply concepts to real scenarios"
-                ],
-                'practice_type': 'hands_on_practice'
-            },
-            'reading': {
-                'explanation': f"📚 {concept['name']}: Deep reading and written analysis will help you excel with this {difficulty.lower()} concept.",
-                'study_tips': [
-                    "Take detailed written notes",
-                    "Summarize key points",
-                    "Create written explanations",
-                    "Use textbook resources"
-                ],
-                'practice_type': 'written_analysis'
-            }
-        }
+        if learning_style not in _STUDY_TIPS:
+            learning_style = 'visual'
         
-        return content_templates.get(learning_style, content_templates['visual'])
\ No newline at end of file
+        return {
+            'explanation': _EXPLANATION_FORMATS[learning_style].format(
+                name=concept['name'], difficulty=concept['difficulty'].lower()
+            ),
+            'study_tips': _STUDY_TIPS[learning_style],
+            'practice_type': _PRACTICE_TYPES[learning_style]
+        }
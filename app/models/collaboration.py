@@ -2,35 +2,392 @@
 Real-time Collaborative Learning System
 Multi-user interaction, study groups, and peer learning
 """
-from datetime import datetime, timedelta
+from collections import deque
+from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Any, Optional
+import atexit
 import json
+import queue
+import threading
+import time
 import uuid
 
+# Chat messages kept in memory per session
+_CHAT_HISTORY = 50
+
+def _new_id() -> str:
+    """Random id for groups, sessions and their content"""
+    # hex skips the dashed formatting of str(uuid4())
+    return uuid.uuid4().hex
+
+def _native(timestamp):
+    """Neo4j DateTime as the tz-aware datetime in-memory content is stamped with"""
+    return timestamp.to_native() if hasattr(timestamp, 'to_native') else timestamp
+
+class _WriteBehind:
+    """Background writer that persists session content in batches
+    
+    Events are queued by kind and flushed every `max_delay` seconds or
+    `max_batch` events, with one UNWIND statement per kind. Kinds are
+    written in the order of `statements`, so questions land before the
+    answers that reference them. A kind whose write fails is re-queued,
+    with every kind after it, until each event has had `max_attempts`
+    tries; what is still failing after that is logged and dropped.
+    """
+    
+    def __init__(self, db, statements: Dict[str, str], max_batch: int = 200,
+                 max_delay: float = 0.1, max_attempts: int = 3):
+        self.db = db
+        self.statements = statements
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self._queue = queue.Queue()
+        
+        threading.Thread(target=self._flush_loop, name='collab-writer', daemon=True).start()
+        atexit.register(self.flush)
+    
+    def put(self, kind: str, event: Dict[str, Any]):
+        self._queue.put((kind, event, 1))
+    
+    def flush(self):
+        """Block until every queued event has been written or given up on"""
+        self._queue.join()
+    
+    def _flush_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    def _write(self, batch: List[tuple]):
+        by_kind = {}
+        for kind, event, attempt in batch:
+            by_kind.setdefault(kind, []).append((event, attempt))
+        
+        error = None
+        for kind, query in self.statements.items():
+            if kind not in by_kind:
+                continue
+            if error is None:
+                try:
+                    self.db.execute_write(query, {'events': [event for event, _ in by_kind[kind]]},
+                                          raise_errors=True)
+                    continue
+                except Exception as e:
+                    error = e
+            # Later kinds may reference this one, so they wait for it
+            self._requeue(kind, by_kind[kind], error)
+    
+    def _requeue(self, kind: str, events: List[tuple], error: Exception):
+        retry = [(event, attempt + 1) for event, attempt in events if attempt < self.max_attempts]
+        dropped = len(events) - len(retry)
+        if dropped:
+            print(f"❌ Dropped {dropped} {kind} write(s) after {self.max_attempts} attempts: {error}")
+        if retry:
+            print(f"Collaboration {kind} write failed, re-queuing {len(retry)}: {error}")
+        
+        # Queued before the batch is marked done, so flush() waits for the retries too
+        for event, attempt in retry:
+            self._queue.put((kind, event, attempt))
+
+# Batched persistence for session content, see _WriteBehind
+_PERSIST_STATEMENTS = {
+    'notes': '''
+        UNWIND $events AS e
+        MATCH (s:CollaborativeSession {id: e.session_id})
+        CREATE (n:SharedNote {
+            id: e.note_id,
+            user_id: e.user_id,
+            content: e.content,
+            timestamp: datetime(),
+            session_id: e.session_id
+        })
+        CREATE (s)-[:HAS_NOTE]->(n)
+    ''',
+    'questions': '''
+        UNWIND $events AS e
+        MATCH (s:CollaborativeSession {id: e.session_id})
+        CREATE (q:Question {
+            id: e.question_id,
+            user_id: e.user_id,
+            question: e.question,
+            timestamp: datetime(),
+            session_id: e.session_id,
+            status: 'open'
+        })
+        CREATE (s)-[:HAS_QUESTION]->(q)
+        WITH e
+        MATCH (u:User {id: e.user_id})
+        SET u.questions_asked = coalesce(u.questions_asked, 0) + 1
+    ''',
+    'answers': '''
+        UNWIND $events AS e
+        MATCH (q:Question {id: e.question_id})
+        CREATE (a:Answer {
+            id: e.answer_id,
+            user_id: e.user_id,
+            answer: e.answer,
+            timestamp: datetime(),
+            helpful_votes: 0
+        })
+        CREATE (q)-[:HAS_ANSWER]->(a)
+        WITH e
+        MATCH (u:User {id: e.user_id})
+        SET u.answers_given = coalesce(u.answers_given, 0) + 1
+    '''
+}
+
+# One writer per database handle, shared by the per-request engines
+_writers = {}
+_writers_lock = threading.Lock()
+
+def _writer_for(db) -> _WriteBehind:
+    with _writers_lock:
+        writer = _writers.get(db)
+        if writer is None:
+            writer = _writers[db] = _WriteBehind(db, _PERSIST_STATEMENTS)
+        return writer
+
+# Group and session queries
+_Q_CREATE_GROUP = '''
+    CREATE (g:StudyGroup {
+        id: $group_id,
+        name: $name,
+        description: $description,
+        creator_id: $creator_id,
+        max_members: $max_members,
+        is_public: $is_public,
+        created_at: datetime(),
+        member_count: 1,
+        active: true
+    })
+    WITH g
+    MATCH (u:User {id: $creator_id})
+    CREATE (u)-[:MEMBER_OF {
+        role: 'admin',
+        joined_at: datetime(),
+        contribution_score: 0
+    }]->(g)
+    SET u.groups_joined = coalesce(u.groups_joined + 1, COUNT { (u)-[:MEMBER_OF]->(:StudyGroup) })
+'''
+
+_Q_GROUP_CAPACITY = '''
+    MATCH (g:StudyGroup {id: $group_id})
+    WHERE g.active = true
+    RETURN g.member_count as current_members, g.max_members as max_members
+'''
+
+_Q_IS_MEMBER = '''
+    MATCH (u:User {id: $user_id})-[:MEMBER_OF]->(g:StudyGroup {id: $group_id})
+    RETURN true as member
+'''
+
+_Q_ADD_MEMBER = '''
+    MATCH (u:User {id: $user_id}), (g:StudyGroup {id: $group_id})
+    CREATE (u)-[:MEMBER_OF {
+        role: $role,
+        joined_at: datetime(),
+        contribution_score: 0
+    }]->(g)
+    SET g.member_count = g.member_count + 1,
+        u.groups_joined = coalesce(u.groups_joined + 1, COUNT { (u)-[:MEMBER_OF]->(:StudyGroup) })
+'''
+
+_Q_CREATE_SESSION = '''
+    MATCH (g:StudyGroup {id: $group_id}), (c:Concept {id: $concept_id})
+    CREATE (s:CollaborativeSession {
+        id: $session_id,
+        group_id: $group_id,
+        concept_id: $concept_id,
+        initiator_id: $initiator_id,
+        started_at: datetime(),
+        status: 'active',
+        participant_count: 0
+    })
+    CREATE (g)-[:HAS_SESSION]->(s)
+    CREATE (s)-[:FOCUSES_ON]->(c)
+'''
+
+_Q_JOIN_SESSION = '''
+    MATCH (s:CollaborativeSession {id: $session_id})
+    WHERE s.status = 'active'
+    OPTIONAL MATCH (u:User {id: $user_id})-[:MEMBER_OF]->(:StudyGroup {id: s.group_id})
+    WITH s, head(collect(u)) as u
+    FOREACH (_ IN CASE WHEN u IS NULL THEN [] ELSE [1] END |
+        SET s.participant_count = s.participant_count + 1
+    )
+    RETURN s.concept_id as concept_id, u IS NOT NULL as is_member,
+           u.name as user_name
+'''
+
+_Q_LOAD_SESSION = '''
+    MATCH (s:CollaborativeSession {id: $session_id})
+    WHERE s.status = 'active'
+    RETURN [(s)-[:HAS_NOTE]->(n:SharedNote) |
+                n {.id, .user_id, .content, .timestamp}] as notes,
+           [(s)-[:HAS_QUESTION]->(q:Question) |
+                q {.id, .user_id, .question, .status, .timestamp,
+                   answers: [(q)-[:HAS_ANSWER]->(a:Answer) |
+                       a {.id, .user_id, .answer, .helpful_votes, .timestamp}]}] as questions
+'''
+
+_Q_MEMBER_GROUPS = '''
+    MATCH (g:StudyGroup)
+    WHERE g.active = true AND (
+        g.is_public = true OR 
+        EXISTS((u:User {id: $user_id})-[:MEMBER_OF]->(g))
+    )
+    OPTIONAL MATCH (u:User {id: $user_id})-[m:MEMBER_OF]->(g)
+    RETURN g.id as id, g.name as name, g.description as description,
+           g.member_count as member_count, g.max_members as max_members,
+           g.created_at as created_at, m IS NOT NULL as is_member
+    ORDER BY g.created_at DESC
+'''
+
+_Q_PUBLIC_GROUPS = '''
+    MATCH (g:StudyGroup)
+    WHERE g.active = true AND g.is_public = true
+    RETURN g.id as id, g.name as name, g.description as description,
+           g.member_count as member_count, g.max_members as max_members,
+           g.created_at as created_at, false as is_member
+    ORDER BY g.created_at DESC
+'''
+
+_Q_ACTIVE_SESSIONS = '''
+    MATCH (g:StudyGroup {id: $group_id})-[:HAS_SESSION]->(s:CollaborativeSession)
+    WHERE s.status = 'active'
+    MATCH (s)-[:FOCUSES_ON]->(c:Concept)
+    RETURN s.id as session_id, s.initiator_id as initiator_id,
+           s.started_at as started_at, s.participant_count as participant_count,
+           c.name as concept_name, c.id as concept_id
+    ORDER BY s.started_at DESC
+'''
+
+# The counters are kept on the User node by the writes that create the
+# relationships. Users who joined groups before groups_joined existed are
+# counted from their memberships until their next join sets the counter
+_Q_COLLABORATION_STATS = '''
+    MATCH (u:User {id: $user_id})
+    RETURN coalesce(u.groups_joined, COUNT { (u)-[:MEMBER_OF]->(:StudyGroup) }) as groups_joined,
+           coalesce(u.questions_asked, 0) as questions_asked,
+           coalesce(u.answers_given, 0) as answers_given,
+           coalesce(u.users_helped,
+                    COUNT { MATCH (u)-[:HELPED]->(other:User) RETURN DISTINCT other }) as users_helped
+'''
+
+_Q_CAN_END_SESSION = '''
+    MATCH (s:CollaborativeSession {id: $session_id})
+    MATCH (g:StudyGroup {id: s.group_id})
+    MATCH (u:User {id: $user_id})-[m:MEMBER_OF]->(g)
+    WHERE s.initiator_id = $user_id OR m.role = 'admin'
+    RETURN s
+'''
+
+_Q_END_SESSION = '''
+    MATCH (s:CollaborativeSession {id: $session_id})
+    SET s.status = 'ended', s.ended_at = datetime()
+'''
+
 class CollaborationEngine:
+    # Routes build an engine per request, so the live session state is
+    # shared by every engine in the process rather than held per instance
+    active_sessions = {}  # In-memory session tracking
+    _locks = {}  # session id -> RLock guarding that session's state
+    _locks_lock = threading.Lock()
+    
     def __init__(self, db):
         self.db = db
-        self.active_sessions = {}  # In-memory session tracking
+        self._writes = _writer_for(db)
+        
+    @staticmethod
+    def _new_session_state() -> Dict[str, Any]:
+        """Empty in-memory state for a collaborative session"""
+        return {
+            'participants': {},
+            'shared_notes': [],
+            'questions': {},  # question id -> question, in the order asked
+            'progress': {},
+            'chat_messages': deque(maxlen=_CHAT_HISTORY)
+        }
+    
+    def _lock(self, session_id: str) -> threading.RLock:
+        """Lock for compound updates to one session's in-memory state"""
+        with self._locks_lock:
+            lock = self._locks.get(session_id)
+            if lock is None:
+                lock = self._locks[session_id] = threading.RLock()
+            return lock
+    
+    def _session_state(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """In-memory state of an active session, loaded from Neo4j on first use"""
+        
+        state = self.active_sessions.get(session_id)
+        if state is not None:
+            return state
+        
+        with self._lock(session_id):
+            # Another request may have loaded it while we waited
+            state = self.active_sessions.get(session_id)
+            if state is None:
+                state = self._load_session(session_id)
+                if state is not None:
+                    self.active_sessions[session_id] = state
+        
+        if state is None:
+            with self._locks_lock:
+                self._locks.pop(session_id, None)
+        
+        return state
+    
+    def _load_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Rebuild a session's notes and questions from the database"""
+        
+        # Content this process has queued must be written before reading back
+        self._writes.flush()
         
+        stored = self.db.execute_single(_Q_LOAD_SESSION, {'session_id': session_id})
+        if stored is None:
+            return None
+        
+        state = self._new_session_state()
+        state['shared_notes'] = sorted(
+            ({**note, 'type': 'note', 'timestamp': _native(note['timestamp'])} for note in stored['notes']),
+            key=lambda item: item['timestamp']
+        )
+        for question in stored['questions']:
+            question['timestamp'] = _native(question['timestamp'])
+            for answer in question['answers']:
+                answer['timestamp'] = _native(answer['timestamp'])
+        for question in sorted(stored['questions'], key=lambda item: item['timestamp']):
+            question['answers'].sort(key=lambda item: item['timestamp'])
+            state['questions'][question['id']] = question
+        
+        return state
+    
     def create_study_group(self, creator_id: str, name: str, description: str, 
                           max_members: int = 10, is_public: bool = True) -> str:
         """Create a new study group"""
         
-        group_id = str(uuid.uuid4())
-        
-        self.db.execute_query('''
-            CREATE (g:StudyGroup {
-                id: $group_id,
-                name: $name,
-                description: $description,
-                creator_id: $creator_id,
-                max_members: $max_members,
-                is_public: $is_public,
-                created_at: datetime(),
-                member_count: 1,
-                active: true
-            })
-        ''', {
+        group_id = _new_id()
+        
+        # The creator's admin membership is created along with the group,
+        # which is why the group starts out with one member
+        self.db.execute_write(_Q_CREATE_GROUP, {
             'group_id': group_id,
             'name': name,
             'description': description,
@@ -39,43 +396,32 @@ class CollaborationEngine:
             'is_public': is_public
         })
         
-        # Add creator as first member
-        self.join_study_group(group_id, creator_id, role='admin')
+        self.db.invalidate_cache('study_groups')
         
         return group_id
     
     def join_study_group(self, group_id: str, user_id: str, role: str = 'member') -> bool:
         """Join a study group"""
         
-        # Check if group exists and has space
-        group_info = self.db.execute_query('''
-            MATCH (g:StudyGroup {id: $group_id})
-            WHERE g.active = true
-            RETURN g.member_count as current_members, g.max_members as max_members
-        ''', {'group_id': group_id})
+        # Check that the group has space and that the user is not already
+        # a member; the two lookups are independent, so overlap them
+        group_info, existing = self.db.run_concurrently(
+            lambda: self.db.execute_scalars(
+                _Q_GROUP_CAPACITY, {'group_id': group_id}, 'current_members', 'max_members'
+            ),
+            lambda: self.db.execute_single(_Q_IS_MEMBER, {'user_id': user_id, 'group_id': group_id})
+        )
         
-        if not group_info or group_info[0]['current_members'] >= group_info[0]['max_members']:
+        if not group_info or group_info[0][0] >= group_info[0][1]:
             return False
         
-        # Check if already a member
-        existing = self.db.execute_query('''
-            MATCH (u:User {id: $user_id})-[m:MEMBER_OF]->(g:StudyGroup {id: $group_id})
-            RETURN m
-        ''', {'user_id': user_id, 'group_id': group_id})
-        
         if existing:
             return False
         
         # Add membership
-        self.db.execute_query('''
-            MATCH (u:User {id: $user_id}), (g:StudyGroup {id: $group_id})
-            CREATE (u)-[:MEMBER_OF {
-                role: $role,
-                joined_at: datetime(),
-                contribution_score: 0
-            }]->(g)
-            SET g.member_count = g.member_count + 1
-        ''', {'user_id': user_id, 'group_id': group_id, 'role': role})
+        self.db.execute_write(_Q_ADD_MEMBER, {'user_id': user_id, 'group_id': group_id, 'role': role})
+        
+        self.db.invalidate_cache('study_groups')
         
         return True
     
@@ -83,37 +429,18 @@ class CollaborationEngine:
                                   initiator_id: str) -> Dict[str, Any]:
         """Start a collaborative learning session"""
         
-        session_id = str(uuid.uuid4())
+        session_id = _new_id()
         
         # Create session in database
-        self.db.execute_query('''
-            MATCH (g:StudyGroup {id: $group_id}), (c:Concept {id: $concept_id})
-            CREATE (s:CollaborativeSession {
-                id: $session_id,
-                group_id: $group_id,
-                concept_id: $concept_id,
-                initiator_id: $initiator_id,
-                started_at: datetime(),
-                status: 'active',
-                participant_count: 0
-            })
-            CREATE (g)-[:HAS_SESSION]->(s)
-            CREATE (s)-[:FOCUSES_ON]->(c)
-        ''', {
+        self.db.execute_write(_Q_CREATE_SESSION, {
             'session_id': session_id,
             'group_id': group_id,
             'concept_id': concept_id,
             'initiator_id': initiator_id
         })
         
-        # Initialize in-memory session
-        self.active_sessions[session_id] = {
-            'participants': {},
-            'shared_notes': [],
-            'questions': [],
-            'progress': {},
-            'chat_messages': []
-        }
+        # Initialize in-memory session; a new session has nothing to load
+        self.active_sessions[session_id] = self._new_session_state()
         
         return {
             'session_id': session_id,
@@ -124,83 +451,57 @@ class CollaborationEngine:
     def join_collaborative_session(self, session_id: str, user_id: str) -> Dict[str, Any]:
         """Join an active collaborative session"""
         
-        # Verify session exists and is active
-        session_info = self.db.execute_query('''
-            MATCH (s:CollaborativeSession {id: $session_id})
-            WHERE s.status = 'active'
-            RETURN s.group_id as group_id, s.concept_id as concept_id
-        ''', {'session_id': session_id})
+        # Check the session and the user's membership of its group, and
+        # count the user in, in a single round trip
+        session_info = self.db.execute_single(_Q_JOIN_SESSION, {'session_id': session_id, 'user_id': user_id},
+                                            write=True)
         
         if not session_info:
             return {'error': 'Session not found or inactive'}
         
-        # Verify user is member of the group
-        membership = self.db.execute_query('''
-            MATCH (u:User {id: $user_id})-[:MEMBER_OF]->(g:StudyGroup {id: $group_id})
-            RETURN u.name as user_name
-        ''', {'user_id': user_id, 'group_id': session_info[0]['group_id']})
-        
-        if not membership:
+        if not session_info['is_member']:
             return {'error': 'Not a member of this study group'}
         
         # Add to session
-        if session_id not in self.active_sessions:
-            self.active_sessions[session_id] = {
-                'participants': {},
-                'shared_notes': [],
-                'questions': [],
-                'progress': {},
-                'chat_messages': []
-            }
-        
-        self.active_sessions[session_id]['participants'][user_id] = {
-            'name': membership[0]['user_name'],
-            'joined_at': datetime.now().isoformat(),
-            'status': 'active',
-            'cursor_position': None
-        }
-        
-        # Update participant count
-        self.db.execute_query('''
-            MATCH (s:CollaborativeSession {id: $session_id})
-            SET s.participant_count = s.participant_count + 1
-        ''', {'session_id': session_id})
+        state = self._session_state(session_id)
+        if state is None:
+            return {'error': 'Session not found or inactive'}
         
-        return {
-            'session_id': session_id,
-            'concept_id': session_info[0]['concept_id'],
-            'participants': self.active_sessions[session_id]['participants'],
-            'shared_notes': self.active_sessions[session_id]['shared_notes']
-        }
+        with self._lock(session_id):
+            state['participants'][user_id] = {
+                'name': session_info['user_name'],
+                'joined_at': datetime.now(timezone.utc),
+                'status': 'active',
+                'cursor_position': None
+            }
+            
+            return {
+                'session_id': session_id,
+                'concept_id': session_info['concept_id'],
+                'participants': dict(state['participants']),
+                'shared_notes': list(state['shared_notes'])
+            }
     
     def add_shared_note(self, session_id: str, user_id: str, note_content: str) -> Dict[str, Any]:
         """Add a note to the shared session"""
         
-        if session_id not in self.active_sessions:
+        state = self._session_state(session_id)
+        if state is None:
             return {'error': 'Session not found'}
         
         note = {
-            'id': str(uuid.uuid4()),
+            'id': _new_id(),
             'user_id': user_id,
             'content': note_content,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': datetime.now(timezone.utc),
             'type': 'note'
         }
         
-        self.active_sessions[session_id]['shared_notes'].append(note)
-        
-        # Persist to database
-        self.db.execute_query('''
-            MATCH (s:CollaborativeSession {id: $session_id})
-            CREATE (n:SharedNote {
-                id: $note_id,
-                user_id: $user_id,
-                content: $content,
-                timestamp: datetime(),
-                session_id: $session_id
-            })
-            CREATE (s)-[:HAS_NOTE]->(n)
-        ''', {
+        with self._lock(session_id):
+            state['shared_notes'].append(note)
+        
+        # Persist to database in the background
+        self._writes.put('notes', {
             'session_id': session_id,
             'note_id': note['id'],
             'user_id': user_id,
@@ -212,33 +513,24 @@ class CollaborationEngine:
     def ask_question(self, session_id: str, user_id: str, question: str) -> Dict[str, Any]:
         """Ask a question in the collaborative session"""
         
-        if session_id not in self.active_sessions:
+        state = self._session_state(session_id)
+        if state is None:
             return {'error': 'Session not found'}
         
         question_obj = {
-            'id': str(uuid.uuid4()),
+            'id': _new_id(),
             'user_id': user_id,
             'question': question,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': datetime.now(timezone.utc),
             'answers': [],
             'status': 'open'
         }
         
-        self.active_sessions[session_id]['questions'].append(question_obj)
-        
-        # Persist to database
-        self.db.execute_query('''
-            MATCH (s:CollaborativeSession {id: $session_id})
-            CREATE (q:Question {
-                id: $question_id,
-                user_id: $user_id,
-                question: $question,
-                timestamp: datetime(),
-                session_id: $session_id,
-                status: 'open'
-            })
-            CREATE (s)-[:HAS_QUESTION]->(q)
-        ''', {
+        with self._lock(session_id):
+            state['questions'][question_obj['id']] = question_obj
+        
+        # Persist to database in the background
+        self._writes.put('questions', {
             'session_id': session_id,
             'question_id': question_obj['id'],
             'user_id': user_id,
@@ -251,41 +543,27 @@ class CollaborationEngine:
                        user_id: str, answer: str) -> Dict[str, Any]:
         """Answer a question in the session"""
         
-        if session_id not in self.active_sessions:
+        state = self._session_state(session_id)
+        if state is None:
             return {'error': 'Session not found'}
         
-        # Find the question
-        question_obj = None
-        for q in self.active_sessions[session_id]['questions']:
-            if q['id'] == question_id:
-                question_obj = q
-                break
-        
-        if not question_obj:
-            return {'error': 'Question not found'}
-        
         answer_obj = {
-            'id': str(uuid.uuid4()),
+            'id': _new_id(),
             'user_id': user_id,
             'answer': answer,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': datetime.now(timezone.utc),
             'helpful_votes': 0
         }
         
-        question_obj['answers'].append(answer_obj)
-        
-        # Persist to database
-        self.db.execute_query('''
-            MATCH (q:Question {id: $question_id})
-            CREATE (a:Answer {
-                id: $answer_id,
-                user_id: $user_id,
-                answer: $answer,
-                timestamp: datetime(),
-                helpful_votes: 0
-            })
-            CREATE (q)-[:HAS_ANSWER]->(a)
-        ''', {
+        # Look up and append under one lock so no answer is lost
+        with self._lock(session_id):
+            question_obj = state['questions'].get(question_id)
+            if not question_obj:
+                return {'error': 'Question not found'}
+            question_obj['answers'].append(answer_obj)
+        
+        # Persist to database in the background
+        self._writes.put('answers', {
             'question_id': question_id,
             'answer_id': answer_obj['id'],
             'user_id': user_id,
@@ -299,60 +577,26 @@ class CollaborationEngine:
         
         if user_id:
             # Get groups user is member of + public groups
-            query = '''
-                MATCH (g:StudyGroup)
-                WHERE g.active = true AND (
-                    g.is_public = true OR 
-                    EXISTS((u:User {id: $user_id})-[:MEMBER_OF]->(g))
-                )
-                OPTIONAL MATCH (u:User {id: $user_id})-[m:MEMBER_OF]->(g)
-                RETURN g.id as id, g.name as name, g.description as description,
-                       g.member_count as member_count, g.max_members as max_members,
-                       g.created_at as created_at, m IS NOT NULL as is_member
-                ORDER BY g.created_at DESC
-            '''
+            query = _Q_MEMBER_GROUPS
             params = {'user_id': user_id}
         else:
             # Get only public groups
-            query = '''
-                MATCH (g:StudyGroup)
-                WHERE g.active = true AND g.is_public = true
-                RETURN g.id as id, g.name as name, g.description as description,
-                       g.member_count as member_count, g.max_members as max_members,
-                       g.created_at as created_at, false as is_member
-                ORDER BY g.created_at DESC
-            '''
+            query = _Q_PUBLIC_GROUPS
             params = {}
         
-        return self.db.execute_query(query, params)
+        # Listings are read far more often than groups change; writers
+        # above drop the cached lists
+        return self.db.cached_query(query, params, ttl=30, tag='study_groups')
     
     def get_active_sessions(self, group_id: str) -> List[Dict[str, Any]]:
         """Get active collaborative sessions for a group"""
         
-        return self.db.execute_query('''
-            MATCH (g:StudyGroup {id: $group_id})-[:HAS_SESSION]->(s:CollaborativeSession)
-            WHERE s.status = 'active'
-            MATCH (s)-[:FOCUSES_ON]->(c:Concept)
-            RETURN s.id as session_id, s.initiator_id as initiator_id,
-                   s.started_at as started_at, s.participant_count as participant_count,
-                   c.name as concept_name, c.id as concept_id
-            ORDER BY s.started_at DESC
-        ''', {'group_id': group_id})
+        return self.db.execute_read(_Q_ACTIVE_SESSIONS, {'group_id': group_id})
     
     def get_collaboration_stats(self, user_id: str) -> Dict[str, Any]:
         """Get user's collaboration statistics"""
         
-        stats = self.db.execute_query('''
-            MATCH (u:User {id: $user_id})
-            OPTIONAL MATCH (u)-[:MEMBER_OF]->(g:StudyGroup)
-            OPTIONAL MATCH (u)-[:CREATED]->(q:Question)
-            OPTIONAL MATCH (u)-[:CREATED]->(a:Answer)
-            OPTIONAL MATCH (u)-[:HELPED]->(other:User)
-            RETURN COUNT(DISTINCT g) as groups_joined,
-                   COUNT(DISTINCT q) as questions_asked,
-                   COUNT(DISTINCT a) as answers_given,
-                   COUNT(DISTINCT other) as users_helped
-        ''', {'user_id': user_id})
+        stats = self.db.execute_read(_Q_COLLABORATION_STATS, {'user_id': user_id})
         
         if not stats:
             return {
@@ -381,57 +625,61 @@ class CollaborationEngine:
     def send_chat_message(self, session_id: str, user_id: str, message: str) -> Dict[str, Any]:
         """Send a chat message in collaborative session"""
         
-        if session_id not in self.active_sessions:
+        state = self._session_state(session_id)
+        if state is None:
             return {'error': 'Session not found'}
         
         chat_message = {
-            'id': str(uuid.uuid4()),
+            'id': _new_id(),
             'user_id': user_id,
             'message': message,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': datetime.now(timezone.utc),
             'type': 'chat'
         }
         
-        self.active_sessions[session_id]['chat_messages'].append(chat_message)
-        
-        # Keep only last 50 messages in memory
-        if len(self.active_sessions[session_id]['chat_messages']) > 50:
-            self.active_sessions[session_id]['chat_messages'] = \
-                self.active_sessions[session_id]['chat_messages'][-50:]
+        # The bounded deque drops the oldest message once it is full
+        with self._lock(session_id):
+            state['chat_messages'].append(chat_message)
         
         return chat_message
     
     def get_session_data(self, session_id: str) -> Dict[str, Any]:
         """Get complete session data for real-time updates"""
         
-        if session_id not in self.active_sessions:
+        data = self._session_state(session_id)
+        if data is None:
             return {'error': 'Session not found'}
         
-        return self.active_sessions[session_id]
+        # Snapshot under the lock so writers cannot change it mid-copy.
+        # Questions and chat are held in a dict and a deque but sent as lists
+        with self._lock(session_id):
+            return {
+                'participants': dict(data['participants']),
+                'shared_notes': list(data['shared_notes']),
+                'questions': list(data['questions'].values()),
+                'progress': dict(data['progress']),
+                'chat_messages': list(data['chat_messages'])
+            }
     
     def end_session(self, session_id: str, user_id: str) -> bool:
         """End a collaborative session"""
         
         # Check if user has permission to end session
-        session_info = self.db.execute_query('''
-            MATCH (s:CollaborativeSession {id: $session_id})
-            MATCH (g:StudyGroup {id: s.group_id})
-            MATCH (u:User {id: $user_id})-[m:MEMBER_OF]->(g)
-            WHERE s.initiator_id = $user_id OR m.role = 'admin'
-            RETURN s
-        ''', {'session_id': session_id, 'user_id': user_id})
+        session_info = self.db.execute_read(_Q_CAN_END_SESSION, {'session_id': session_id, 'user_id': user_id})
         
         if not session_info:
             return False
         
+        # Write out the session's pending content before closing it
+        self._writes.flush()
+        
         # Update session status
-        self.db.execute_query('''
-            MATCH (s:CollaborativeSession {id: $session_id})
-            SET s.status = 'ended', s.ended_at = datetime()
-        ''', {'session_id': session_id})
+        self.db.execute_write(_Q_END_SESSION, {'session_id': session_id})
         
         # Clean up in-memory data
-        if session_id in self.active_sessions:
-            del self.active_sessions[session_id]
+        with self._lock(session_id):
+            self.active_sessions.pop(session_id, None)
+        with self._locks_lock:
+            self._locks.pop(session_id, None)
         
         return True
\ No newline at end of file
@@ -1,54 +1,99 @@
+from collections import namedtuple
 from typing import List, Dict, Any, Optional
 
+# Row shape for templates: field access is a slot lookup rather than
+# Jinja's failed getattr followed by a dict subscript
+ConceptSummary = namedtuple('ConceptSummary', ['id', 'name', 'difficulty', 'completed'])
+
+_Q_ALL_CONCEPTS = '''
+    MATCH (c:Concept)
+    RETURN c.id as id, c.name as name, c.difficulty as difficulty,
+           COALESCE(c.completed, false) as completed
+    ORDER BY c.difficulty, c.name
+'''
+
+_Q_CONCEPT_DETAILS = '''
+    MATCH (c:Concept {id: $concept_id})
+    RETURN c.id as id, c.name as name, c.difficulty as difficulty,
+           COALESCE(c.completed, false) as completed
+'''
+
+_Q_CONCEPTS_BY_IDS = '''
+    MATCH (c:Concept)
+    WHERE c.id IN $concept_ids
+    RETURN c.id as id, c.name as name, c.difficulty as difficulty,
+           COALESCE(c.completed, false) as completed
+'''
+
+_Q_PREREQUISITES = '''
+    MATCH (prereq:Concept)-[:PREREQUISITE_FOR]->(c:Concept {id: $concept_id})
+    RETURN prereq.id as id, prereq.name as name, prereq.difficulty as difficulty
+'''
+
+_Q_NEXT_CONCEPTS = '''
+    MATCH (c:Concept {id: $concept_id})-[:PREREQUISITE_FOR]->(next:Concept)
+    RETURN next.id as id, next.name as name, next.difficulty as difficulty
+'''
+
+_Q_CONCEPT_WITH_NEIGHBORS = '''
+    MATCH (c:Concept {id: $concept_id})
+    RETURN c.id as id, c.name as name, c.difficulty as difficulty,
+           COALESCE(c.completed, false) as completed,
+           [(prereq:Concept)-[:PREREQUISITE_FOR]->(c) |
+            {id: prereq.id, name: prereq.name, difficulty: prereq.difficulty}] as prerequisites,
+           [(c)-[:PREREQUISITE_FOR]->(next:Concept) |
+            {id: next.id, name: next.name, difficulty: next.difficulty}] as next_concepts
+'''
+
+_Q_LEARNING_PATH = '''
+    MATCH (c:Concept)
+    WITH c,
+         EXISTS { (:User {id: $user_id})-[:COMPLETED]->(c) } as completed,
+         [(prereq:Concept)-[:PREREQUISITE_FOR]->(c) | prereq.id] as prerequisites
+    RETURN c.id as id, c.name as name, c.difficulty as difficulty,
+           completed, prerequisites
+    ORDER BY completed, c.difficulty
+'''
+
 class Course:
     def __init__(self, db):
         self.db = db
+        self._summaries = (None, [])
     
     def get_all_concepts(self) -> List[Dict[str, Any]]:
-        query = '''
-            MATCH (c:Concept)
-            RETURN c.id as id, c.name as name, c.difficulty as difficulty,
-                   COALESCE(c.completed, false) as completed
-            ORDER BY c.difficulty, c.name
-        '''
-        return self.db.execute_query(query)
+        # Shared rows; dropped with the graph cache when concepts change
+        return self.db.cached_query(_Q_ALL_CONCEPTS, ttl=300, tag='concepts')
+    
+    def get_all_concepts_summary(self) -> List[ConceptSummary]:
+        rows = self.get_all_concepts()
+        
+        # The cache hands back the same list until it expires, so convert once per cached result
+        cached_rows, summaries = self._summaries
+        if rows is not cached_rows:
+            summaries = [ConceptSummary(row['id'], row['name'], row['difficulty'], row['completed'])
+                         for row in rows]
+            self._summaries = (rows, summaries)
+        return summaries
     
     def get_concept_details(self, concept_id: str) -> Optional[Dict[str, Any]]:
-        query = '''
-            MATCH (c:Concept {id: $concept_id})
-            RETURN c.id as id, c.name as name, c.difficulty as difficulty,
-                   COALESCE(c.completed, false) as completed
-        '''
-        result = self.db.execute_query(query, {'concept_id': concept_id})
-        return result[0] if result else None
+        return self.db.execute_single(_Q_CONCEPT_DETAILS, {'concept_id': concept_id})
+    
+    def get_concepts_by_ids(self, concept_ids: List[str]) -> List[Dict[str, Any]]:
+        # One IN-list lookup instead of a get_concept_details call per id
+        return self.db.execute_read(_Q_CONCEPTS_BY_IDS, {'concept_ids': list(concept_ids)})
     
     def get_prerequisites(self, concept_id: str) -> List[Dict[str, Any]]:
-        query = '''
-            MATCH (prereq:Concept)-[:PREREQUISITE_FOR]->(c:Concept {id: $concept_id})
-            RETURN prereq.id as id, prereq.name as name, prereq.difficulty as difficulty
-        '''
-        return self.db.execute_query(query, {'concept_id': concept_id})
+        return self.db.execute_read(_Q_PREREQUISITES, {'concept_id': concept_id})
     
     def get_next_concepts(self, concept_id: str) -> List[Dict[str, Any]]:
-        query = '''
-            MATCH (c:Concept {id: $concept_id})-[:PREREQUISITE_FOR]->(next:Concept)
-            RETURN next.id as id, next.name as name, next.difficulty as difficulty
-        '''
-        return self.db.execute_query(query, {'concept_id': concept_id})
+        return self.db.execute_read(_Q_NEXT_CONCEPTS, {'concept_id': concept_id})
+    
+    def get_concept_with_neighbors(self, concept_id: str) -> Optional[Dict[str, Any]]:
+        # Concept details plus its prerequisites and next concepts in one round trip
+        return self.db.execute_single(_Q_CONCEPT_WITH_NEIGHBORS, {'concept_id': concept_id})
     
     def get_learning_path(self, user_id: str = None) -> List[Dict[str, Any]]:
         if user_id:
-            query = '''
-                MATCH (c:Concept)
-                OPTIONAL MATCH (u:User {id: $user_id})-[:COMPLETED]->(c)
-                WITH c, (u IS NOT NULL) as completed
-                MATCH (c)
-                OPTIONAL MATCH (prereq:Concept)-[:PREREQUISITE_FOR]->(c)
-                WITH c, completed, collect(prereq.id) as prerequisites
-                RETURN c.id as id, c.name as name, c.difficulty as difficulty,
-                       completed, prerequisites
-                ORDER BY completed, c.difficulty
-            '''
-            return self.db.execute_query(query, {'user_id': user_id})
+            return self.db.execute_read(_Q_LEARNING_PATH, {'user_id': user_id})
         else:
             return self.get_all_concepts()
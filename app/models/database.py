@@ -1,60 +1,428 @@
 from neo4j import GraphDatabase
+from cachetools import LRUCache
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import atexit
+import heapq
+import itertools
+import json
 import os
-from typing import Dict, List, Any
+import threading
+import time
+from typing import Dict, List, Any, Callable, Optional
+
+# Cypher statements live at module level so every call sends the same text
+# and Neo4j reuses the cached plan; the models follow the same convention
+
+# Tries a background write gets before it is dead-lettered, and how long
+# close() lets the last queued writes run before the process exits anyway
+_BACKGROUND_ATTEMPTS = int(os.getenv('NEO4J_BACKGROUND_ATTEMPTS', '6'))
+_BACKGROUND_FLUSH_SECONDS = float(os.getenv('NEO4J_BACKGROUND_FLUSH_SECONDS', '5'))
+
+_Q_HAS_SAMPLE_COURSE = '''
+    MATCH (:Course {id: 'mit-stats'})-[:CONTAINS]->(:Concept)
+    RETURN 1 LIMIT 1
+'''
+
+_Q_MERGE_COURSE = '''
+    MERGE (course:Course {id: 'mit-stats'})
+    SET course.name = 'MIT Introduction to Probability and Statistics',
+        course.description = 'Interactive graph-based statistics course'
+'''
+
+_Q_MERGE_CONCEPTS = '''
+    UNWIND $rows AS row
+    MERGE (c:Concept {id: row.id})
+    SET c.name = row.name, c.difficulty = row.difficulty, c.completed = false
+'''
+
+_Q_MERGE_PREREQUISITES = '''
+    UNWIND $pairs AS pair
+    MATCH (p:Concept {id: pair.prereq}), (c:Concept {id: pair.concept})
+    MERGE (p)-[:PREREQUISITE_FOR]->(c)
+'''
+
+_Q_DROP_INVALID_CONCEPTS = '''
+    MATCH (c:Concept)
+    WHERE c.name IS NULL OR c.difficulty IS NULL
+    DETACH DELETE c
+'''
+
+_Q_LINK_COURSE = '''
+    MATCH (course:Course {id: 'mit-stats'}), (c:Concept)
+    WHERE c.name IS NOT NULL AND c.difficulty IS NOT NULL
+    MERGE (course)-[:CONTAINS]->(c)
+'''
+
+_Q_GRAPH_NODES = '''
+    MATCH (c:Concept)
+    WHERE c.name IS NOT NULL AND c.difficulty IS NOT NULL
+    RETURN c.id as id, c.name as name, c.difficulty as difficulty, 
+           COALESCE(c.completed, false) as completed
+'''
+
+_Q_GRAPH_EDGES = '''
+    MATCH (c1:Concept)-[r:PREREQUISITE_FOR]->(c2:Concept)
+    RETURN c1.id as source, c2.id as target, 'prerequisite' as type
+'''
+
+def _all_records(result) -> List[Dict[str, Any]]:
+    return [record.data() for record in result]
+
+def _first_record(result) -> Optional[Dict[str, Any]]:
+    record = next(iter(result), None)
+    result.consume()
+    return record.data() if record else None
 
 class Neo4jDB:
     def __init__(self):
         self.uri = os.getenv('NEO4J_URI', 'bolt://localhost:7687')
         self.user = os.getenv('NEO4J_USER', 'neo4j')
         self.password = os.getenv('NEO4J_PASSWORD', 'password123')
+        # Naming the database up front spares the server a routing lookup per session
+        self.database = os.getenv('NEO4J_DB', 'neo4j')
+        
+        # One long-lived session per thread, see _session()
+        self._local = threading.local()
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
         
         try:
-            self.driver = GraphDatabase.driver(self.uri, auth=(self.user, self.password))
+            self.driver = GraphDatabase.driver(
+                self.uri, auth=(self.user, self.password),
+                max_connection_pool_size=int(os.getenv('NEO4J_POOL', '50')),
+                connection_acquisition_timeout=30,
+                max_connection_lifetime=1800,
+                keep_alive=True
+            )
             # Test connection
-            with self.driver.session() as session:
+            with self.driver.session(database=self.database) as session:
                 session.run("RETURN 1")
             print(f"✅ Connected to Neo4j at {self.uri}")
         except Exception as e:
             print(f"❌ Failed to connect to Neo4j: {e}")
             self.driver = None
+        
+        # Worker threads for overlapping independent queries
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('NEO4J_QUERY_WORKERS', '8')),
+            thread_name_prefix='neo4j-query'
+        )
+        
+        # Fire-and-forget writes get their own thread so retries never hold up
+        # run_concurrently's request fan-out, see run_in_background(). It is a
+        # daemon: a non-daemon worker is joined before atexit runs close(), so a
+        # write retrying against a dead server would keep the process alive.
+        self._background_jobs = []  # heap of (due, seq, attempt, call, on_give_up)
+        self._background_ready = threading.Condition()
+        self._background_seq = itertools.count()
+        self._closing = threading.Event()
+        # Background writes that gave up, newest last, for inspection
+        self.dead_letters = deque(maxlen=100)
+        self._background = threading.Thread(target=self._run_background,
+                                            name='neo4j-background', daemon=True)
+        self._background.start()
+        
+        # Recently read results, see cached_query()
+        self._query_cache = LRUCache(maxsize=int(os.getenv('NEO4J_QUERY_CACHE_SIZE', '4096')))
+        self._cache_lock = threading.Lock()
+        
+        atexit.register(self.close)
+    
+    def _session(self):
+        '''This thread's session, opened on first use'''
+        session = getattr(self._local, 'session', None)
+        
+        if session is None:
+            session = self.driver.session(database=self.database)
+            self._local.session = session
+            
+            with self._sessions_lock:
+                # Close the sessions of request threads that have since finished
+                for thread in [t for t in self._sessions if not t.is_alive()]:
+                    self._sessions.pop(thread).close()
+                self._sessions[threading.current_thread()] = session
+        
+        return session
+    
+    def _discard_session(self):
+        '''Drop this thread's session after an error so the next query starts clean'''
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            return
+        
+        self._local.session = None
+        with self._sessions_lock:
+            self._sessions.pop(threading.current_thread(), None)
+        try:
+            session.close()
+        except Exception:
+            pass
     
     def execute_query(self, query: str, parameters: dict = None) -> List[Dict[str, Any]]:
         if not self.driver:
             return []
         
         try:
-            with self.driver.session() as session:
-                result = session.run(query, parameters or {})
-                return [record.data() for record in result]
+            result = self._session().run(query, parameters or {})
+            return [record.data() for record in result]
         except Exception as e:
             print(f"Query error: {e}")
+            self._discard_session()
             return []
     
+    def execute_read(self, query: str, parameters: dict = None) -> List[Dict[str, Any]]:
+        '''Run a read query in a managed transaction, retried on transient errors'''
+        return self._execute_managed(query, parameters, write=False)
+    
+    def execute_write(self, query: str, parameters: dict = None,
+                      raise_errors: bool = False) -> List[Dict[str, Any]]:
+        '''Run a write query in a managed transaction, retried on transient errors
+        
+        Errors are logged and give [] unless raise_errors is set.
+        '''
+        if raise_errors:
+            if not self.driver:
+                raise RuntimeError("Not connected to Neo4j")
+            return self._run_managed(query, parameters, write=True)
+        return self._execute_managed(query, parameters, write=True)
+    
+    def _execute_managed(self, query: str, parameters: dict, write: bool) -> List[Dict[str, Any]]:
+        if not self.driver:
+            return []
+        
+        try:
+            return self._run_managed(query, parameters, write)
+        except Exception as e:
+            print(f"Query error: {e}")
+            return []
+    
+    def _run_managed(self, query: str, parameters: dict, write: bool, collect: Callable = None) -> Any:
+        '''Managed transaction that lets driver and query errors propagate
+        
+        `collect` turns the result into the return value, all records as
+        dicts by default. A failure discards this thread's session first.
+        '''
+        collect = collect or _all_records
+        
+        # The driver may call this again on retry, so it reads everything it needs
+        def work(tx):
+            return collect(tx.run(query, parameters or {}))
+        
+        try:
+            session = self._session()
+            return session.execute_write(work) if write else session.execute_read(work)
+        except Exception:
+            self._discard_session()
+            raise
+    
+    def execute_single(self, query: str, parameters: dict = None,
+                       write: bool = False) -> Optional[Dict[str, Any]]:
+        '''First record of the result as a dict, or None without materializing the rest
+        
+        Runs as a managed read, or as a managed write when `write` is set.
+        '''
+        if not self.driver:
+            return None
+        
+        try:
+            return self._run_managed(query, parameters, write, _first_record)
+        except Exception as e:
+            print(f"Query error: {e}")
+            return None
+    
+    def execute_scalars(self, query: str, parameters: dict = None, *keys: str) -> List[tuple]:
+        '''Rows as tuples of just `keys`, skipping the dict built by record.data()'''
+        if not self.driver:
+            return []
+        
+        def collect(result):
+            return [tuple(record[key] for key in keys) for record in result]
+        
+        try:
+            return self._run_managed(query, parameters, False, collect)
+        except Exception as e:
+            print(f"Query error: {e}")
+            return []
+    
+    def execute_many(self, statements: List[str]) -> bool:
+        '''Run several statements back to back on a single session'''
+        if not self.driver:
+            return False
+        
+        try:
+            session = self._session()
+            for statement in statements:
+                session.run(statement).consume()
+            return True
+        except Exception as e:
+            print(f"Query error: {e}")
+            self._discard_session()
+            return False
+    
+    def cached_query(self, query: str, parameters: dict = None, ttl: float = 30,
+                     tag: str = None) -> List[Dict[str, Any]]:
+        '''Read query whose result is reused for `ttl` seconds
+        
+        The returned rows are shared between callers and must not be mutated.
+        Writers drop the entries they affect with invalidate_cache(tag).
+        '''
+        key = (tag, query, json.dumps(parameters or {}, sort_keys=True, default=str))
+        now = time.monotonic()
+        
+        with self._cache_lock:
+            entry = self._query_cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+        
+        if not self.driver:
+            return []
+        
+        # Failures are not stored, so an outage only empties this caller's result
+        try:
+            rows = self._run_managed(query, parameters, write=False)
+        except Exception as e:
+            print(f"Query error: {e}")
+            return []
+        
+        with self._cache_lock:
+            self._query_cache[key] = (now + ttl, rows)
+        return rows
+    
+    def invalidate_cache(self, tag: str):
+        '''Forget every cached result stored under `tag`'''
+        with self._cache_lock:
+            for key in [key for key in self._query_cache if key[0] == tag]:
+                del self._query_cache[key]
+    
+    def run_concurrently(self, *calls: Callable[[], Any]) -> List[Any]:
+        '''Run independent query callables in parallel, returning results in call order'''
+        futures = [self._executor.submit(call) for call in calls]
+        return [future.result() for future in futures]
+    
+    def run_in_background(self, call: Callable[[], Any],
+                          on_give_up: Callable[[Exception], Any] = None):
+        '''Run a write callable on the background thread without waiting for it
+        
+        A call that raises is retried with backoff, up to _BACKGROUND_ATTEMPTS
+        tries. One that still fails is logged, kept in dead_letters and handed
+        to on_give_up, and so is one that shutdown cuts short.
+        '''
+        self._schedule_background(0, 1, call, on_give_up)
+    
+    def _schedule_background(self, delay: float, attempt: int, call, on_give_up):
+        with self._background_ready:
+            heapq.heappush(self._background_jobs, (time.monotonic() + delay, next(self._background_seq),
+                                                   attempt, call, on_give_up))
+            self._background_ready.notify()
+    
+    def _run_background(self):
+        while True:
+            with self._background_ready:
+                while not self._closing.is_set():
+                    wait = self._background_jobs[0][0] - time.monotonic() if self._background_jobs else None
+                    if wait is not None and wait <= 0:
+                        break
+                    self._background_ready.wait(wait)
+                else:
+                    break
+                _, _, attempt, call, on_give_up = heapq.heappop(self._background_jobs)
+            
+            # Writes waiting on a retry let later ones run in the meantime
+            self._attempt_background(call, attempt, on_give_up, final=False)
+        
+        # Shutting down: one last try each, for as long as close() waits
+        deadline = time.monotonic() + _BACKGROUND_FLUSH_SECONDS
+        while True:
+            with self._background_ready:
+                if not self._background_jobs:
+                    return
+                _, _, attempt, call, on_give_up = heapq.heappop(self._background_jobs)
+            
+            if time.monotonic() < deadline:
+                self._attempt_background(call, attempt, on_give_up, final=True)
+            else:
+                self._give_up(call, on_give_up, TimeoutError("Shut down before the write was tried"))
+    
+    def _attempt_background(self, call, attempt: int, on_give_up, final: bool):
+        try:
+            call()
+            return
+        except Exception as e:
+            if final or attempt >= _BACKGROUND_ATTEMPTS:
+                self._give_up(call, on_give_up, e)
+                return
+            delay = min(0.5 * 2 ** (attempt - 1), 30)
+            print(f"Background write failed, retrying in {delay:g}s: {e}")
+        
+        self._schedule_background(delay, attempt + 1, call, on_give_up)
+    
+    def _give_up(self, call, on_give_up, error: Exception):
+        print(f"❌ Background write dropped: {error}")
+        self.dead_letters.append((call, error))
+        if on_give_up:
+            try:
+                on_give_up(error)
+            except Exception as e:
+                print(f"Background give-up handler failed: {e}")
+    
     def close(self):
+        # Let queued background writes land (one last try each) before the
+        # driver goes away, but never hold the process up past the flush window
+        with self._background_ready:
+            self._closing.set()
+            self._background_ready.notify()
+        self._background.join(_BACKGROUND_FLUSH_SECONDS + 1)
+        self._executor.shutdown(wait=False)
+        
+        with self._sessions_lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            try:
+                session.close()
+            except Exception:
+                pass
+        
         if self.driver:
             self.driver.close()
     
-    def create_sample_course(self):
-        '''Initialize MIT Statistics course with sample data'''
+    def has_sample_course(self) -> bool:
+        '''Whether the sample course has already been fully created'''
         
-        # Create constraints
-        constraints = [
+        # Linking concepts to the course is the last seeding step
+        return bool(self.execute_read(_Q_HAS_SAMPLE_COURSE))
+    
+    def ensure_indexes(self):
+        '''Create the constraints and indexes the queries look nodes up by'''
+        
+        # Every statement is IF NOT EXISTS, so one session covers them all
+        self.execute_many([
             "CREATE CONSTRAINT concept_id_unique IF NOT EXISTS FOR (c:Concept) REQUIRE c.id IS UNIQUE",
-            "CREATE CONSTRAINT user_id_unique IF NOT EXISTS FOR (u:User) REQUIRE u.id IS UNIQUE"
-        ]
+            "CREATE CONSTRAINT user_id_unique IF NOT EXISTS FOR (u:User) REQUIRE u.id IS UNIQUE",
+            "CREATE INDEX study_group_id IF NOT EXISTS FOR (g:StudyGroup) ON (g.id)",
+            "CREATE INDEX session_id IF NOT EXISTS FOR (s:CollaborativeSession) ON (s.id)",
+            "CREATE INDEX session_status IF NOT EXISTS FOR (s:CollaborativeSession) ON (s.status)",
+            "CREATE INDEX question_id IF NOT EXISTS FOR (q:Question) ON (q.id)",
+            "CREATE INDEX answer_id IF NOT EXISTS FOR (a:Answer) ON (a.id)",
+            "CREATE INDEX shared_note_session IF NOT EXISTS FOR (n:SharedNote) ON (n.session_id)",
+            "CREATE INDEX concept_difficulty IF NOT EXISTS FOR (c:Concept) ON (c.difficulty)",
+            "CREATE INDEX achievement_id IF NOT EXISTS FOR (a:Achievement) ON (a.achievement_id)",
+            "CREATE INDEX completed_timestamp IF NOT EXISTS FOR ()-[r:COMPLETED]-() ON (r.timestamp)",
+            "CREATE INDEX user_total_points IF NOT EXISTS FOR (u:User) ON (u.total_points)",
+            "CREATE INDEX user_points_week IF NOT EXISTS FOR (u:User) ON (u.points_week)",
+            # Last, so a graph that already holds duplicate emails still gets the indexes above
+            "CREATE CONSTRAINT user_email_unique IF NOT EXISTS FOR (u:User) REQUIRE u.email IS UNIQUE"
+        ])
+    
+    def create_sample_course(self):
+        '''Initialize MIT Statistics course with sample data'''
         
-        for constraint in constraints:
-            try:
-                self.execute_query(constraint)
-            except:
-                pass  # Constraint might already exist
+        self.ensure_indexes()
         
         # Create course
-        self.execute_query('''
-            MERGE (course:Course {id: 'mit-stats'})
-            SET course.name = 'MIT Introduction to Probability and Statistics',
-                course.description = 'Interactive graph-based statistics course'
-        ''')
+        self.execute_write(_Q_MERGE_COURSE)
         
         # Create concepts with relationships
         concepts = [
@@ -69,11 +437,7 @@ class Neo4jDB:
             {'id': 'regression', 'name': 'Linear Regression', 'difficulty': 'Advanced'}
         ]
         
-        for concept in concepts:
-            self.execute_query('''
-                MERGE (c:Concept {id: $id})
-                SET c.name = $name, c.difficulty = $difficulty, c.completed = false
-            ''', concept)
+        self.execute_write(_Q_MERGE_CONCEPTS, {'rows': concepts})
         
         # Create prerequisite relationships
         prereqs = [
@@ -87,45 +451,37 @@ class Neo4jDB:
             ('random_vars', 'regression')
         ]
         
-        for prereq, concept in prereqs:
-            self.execute_query('''
-                MATCH (p:Concept {id: $prereq}), (c:Concept {id: $concept})
-                MERGE (p)-[:PREREQUISITE_FOR]->(c)
-            ''', {'prereq': prereq, 'concept': concept})
+        self.execute_write(_Q_MERGE_PREREQUISITES, {
+            'pairs': [{'prereq': prereq, 'concept': concept} for prereq, concept in prereqs]
+        })
         
         # Clean up any invalid concepts
-        self.execute_query('''
-            MATCH (c:Concept)
-            WHERE c.name IS NULL OR c.difficulty IS NULL
-            DETACH DELETE c
-        ''')
+        self.execute_write(_Q_DROP_INVALID_CONCEPTS)
         
         # Link to course
-        self.execute_query('''
-            MATCH (course:Course {id: 'mit-stats'}), (c:Concept)
-            WHERE c.name IS NOT NULL AND c.difficulty IS NOT NULL
-            MERGE (course)-[:CONTAINS]->(c)
-        ''')
+        self.execute_write(_Q_LINK_COURSE)
         
+        self.invalidate_cache('concepts')
+        self.invalidate_cache('concept_count')
         print("✅ MIT Statistics course created with 9 concepts")
     
     def get_course_graph(self) -> Dict[str, Any]:
-        '''Get complete course graph for visualization'''
+        '''Get complete course graph for visualization
         
-        # Get nodes (filter out invalid ones)
-        nodes_query = '''
-            MATCH (c:Concept)
-            WHERE c.name IS NOT NULL AND c.difficulty IS NOT NULL
-            RETURN c.id as id, c.name as name, c.difficulty as difficulty, 
-                   COALESCE(c.completed, false) as completed
+        Concepts are seeded once, so the graph is cached under the
+        'concepts' tag and dropped when a completion flips c.completed.
         '''
-        nodes = self.execute_query(nodes_query)
+        
+        # Get nodes (filter out invalid ones)
+        nodes = self.cached_query(_Q_GRAPH_NODES, ttl=300, tag='concepts')
         
         # Get relationships
-        edges_query = '''
-            MATCH (c1:Concept)-[r:PREREQUISITE_FOR]->(c2:Concept)
-            RETURN c1.id as source, c2.id as target, 'prerequisite' as type
-        '''
-        edges = self.execute_query(edges_query)
+        edges = self.cached_query(_Q_GRAPH_EDGES, ttl=300, tag='concepts')
         
         return {'nodes': nodes, 'edges': edges}
+
+
+@lru_cache(maxsize=None)
+def get_db() -> Neo4jDB:
+    '''The process-wide database handle shared by the app and its models'''
+    return Neo4jDB()
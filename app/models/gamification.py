@@ -3,226 +3,289 @@ Advanced Gamification System
 Achievement system, skill trees, and competitive learning
 """
 from datetime import datetime, timedelta
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Tuple
+import bisect
 import json
+import math
+
+# Achievement and skill tree definitions are static, so they are built
+# once at import rather than for every engine
+
+_ACHIEVEMENTS = {
+    'first_steps': {
+        'name': '🚀 First Steps',
+        'description': 'Complete your first concept',
+        'points': 100,
+        'type': 'milestone'
+    },
+    'speed_demon': {
+        'name': '⚡ Speed Demon',
+        'description': 'Complete 3 concepts in one day',
+        'points': 250,
+        'type': 'performance'
+    },
+    'perfectionist': {
+        'name': '💎 Perfectionist',
+        'description': 'Complete 5 concepts with 100% accuracy',
+        'points': 500,
+        'type': 'mastery'
+    },
+    'knowledge_seeker': {
+        'name': '🔍 Knowledge Seeker',
+        'description': 'Complete 10 concepts',
+        'points': 300,
+        'type': 'milestone'
+    },
+    'master_learner': {
+        'name': '🎓 Master Learner',
+        'description': 'Complete all concepts in a difficulty level',
+        'points': 1000,
+        'type': 'mastery'
+    },
+    'streak_master': {
+        'name': '🔥 Streak Master',
+        'description': 'Maintain a 7-day learning streak',
+        'points': 750,
+        'type': 'consistency'
+    },
+    'collaboration_champion': {
+        'name': '🤝 Collaboration Champion',
+        'description': 'Help 5 other learners',
+        'points': 400,
+        'type': 'social'
+    },
+    'ai_whisperer': {
+        'name': '🤖 AI Whisperer',
+        'description': 'Use AI recommendations 10 times',
+        'points': 200,
+        'type': 'engagement'
+    }
+}
+
+# (achievement_id, stat, threshold): earned once stats[stat] >= threshold
+_ACHIEVEMENT_RULES = (
+    ('first_steps', 'concepts_completed', 1),
+    ('speed_demon', 'concepts_today', 3),
+    ('perfectionist', 'perfect_completions', 5),
+    ('knowledge_seeker', 'concepts_completed', 10),
+    ('master_learner', 'difficulty_mastered', 1),
+    ('streak_master', 'current_streak', 7),
+    ('collaboration_champion', 'helped_others', 5),
+    ('ai_whisperer', 'ai_interactions', 10)
+)
+
+_SKILL_TREES = {
+    'statistics_fundamentals': {
+        'name': 'Statistics Fundamentals',
+        'icon': '📊',
+        'levels': [
+            {'name': 'Novice', 'required_points': 0, 'bonus': 'Basic progress tracking'},
+            {'name': 'Apprentice', 'required_points': 500, 'bonus': '+10% XP for beginner concepts'},
+            {'name': 'Practitioner', 'required_points': 1500, 'bonus': 'Unlock advanced hints'},
+            {'name': 'Expert', 'required_points': 3000, 'bonus': '+20% XP for all concepts'},
+            {'name': 'Master', 'required_points': 5000, 'bonus': 'Unlock teaching mode'}
+        ]
+    },
+    'learning_efficiency': {
+        'name': 'Learning Efficiency',
+        'icon': '⚡',
+        'levels': [
+            {'name': 'Beginner', 'required_points': 0, 'bonus': 'Standard learning speed'},
+            {'name': 'Focused', 'required_points': 300, 'bonus': 'Reduced distraction penalties'},
+            {'name': 'Optimized', 'required_points': 800, 'bonus': 'AI-powered study recommendations'},
+            {'name': 'Accelerated', 'required_points': 2000, 'bonus': 'Fast-track learning paths'},
+            {'name': 'Transcendent', 'required_points': 4000, 'bonus': 'Instant mastery detection'}
+        ]
+    },
+    'collaboration_master': {
+        'name': 'Collaboration Master',
+        'icon': '🤝',
+        'levels': [
+            {'name': 'Solo', 'required_points': 0, 'bonus': 'Individual learning only'},
+            {'name': 'Helper', 'required_points': 200, 'bonus': 'Can assist other learners'},
+            {'name': 'Mentor', 'required_points': 600, 'bonus': 'Unlock group study sessions'},
+            {'name': 'Leader', 'required_points': 1200, 'bonus': 'Create learning communities'},
+            {'name': 'Guru', 'required_points': 2500, 'bonus': 'Global leaderboard access'}
+        ]
+    }
+}
+
+# Ascending required_points per tree, for bisecting a user's current level
+_SKILL_TREE_THRESHOLDS = {
+    tree_id: [level['required_points'] for level in tree['levels']]
+    for tree_id, tree in _SKILL_TREES.items()
+}
+
+# Every aggregate comes back in one record; each is counted in its own
+# subquery or COUNT {} so the dimensions do not multiply into each other,
+# and plain relationship counts come from the node's degree
+_Q_USER_STATS = '''
+    MATCH (u:User {id: $user_id})
+    CALL {
+        WITH u
+        OPTIONAL MATCH (u)-[c:COMPLETED]->(concept:Concept)
+        RETURN COUNT(DISTINCT concept) as concepts_completed,
+               COUNT(CASE WHEN date(c.timestamp) = date() THEN 1 END) as concepts_today,
+               COUNT(CASE WHEN c.accuracy >= 1.0 THEN 1 END) as perfect_completions
+    }
+    CALL {
+        WITH u
+        MATCH (concept:Concept)
+        WITH concept.difficulty as difficulty, COUNT(*) as total_concepts,
+             COUNT(CASE WHEN EXISTS { (u)-[:COMPLETED]->(concept) } THEN 1 END) as completed_concepts
+        WHERE completed_concepts = total_concepts
+        RETURN COUNT(*) as difficulty_mastered
+    }
+    RETURN concepts_completed, concepts_today, perfect_completions,
+           COUNT { (u)-[:HELPED]->(:User) } as helped_others,
+           COUNT { (u)-[:AI_INTERACTION]->() } as ai_interactions,
+           difficulty_mastered,
+           [(u)-[:EARNED]->(a:Achievement) | a.achievement_id] as earned_ids,
+           COALESCE(u.total_points, 0) as total_points,
+           COALESCE(u.current_streak, 0) as current_streak
+'''
+
+# weekly_points is kept by _Q_CREDIT_POINTS, so only the top ten users
+# have their recent completions counted
+_Q_WEEKLY_LEADERBOARD = '''
+    MATCH (u:User)
+    WHERE u.points_week = date().weekYear * 100 + date().week
+    WITH u
+    ORDER BY u.weekly_points DESC
+    LIMIT $limit
+    RETURN u.name as name, u.id as user_id,
+           COUNT { (u)-[c:COMPLETED]->(:Concept)
+                   WHERE c.timestamp >= datetime() - duration('P7D') } as completions,
+           u.weekly_points as points, u.avatar as avatar
+    ORDER BY points DESC, completions DESC
+'''
+
+# Ordering on the bare property lets the user_total_points index serve the
+# top of the ranking; users who never earned points rank as 0 from a second
+# branch, so a short board still fills up with them. Completions are only
+# looked up for the users kept.
+_Q_ALL_TIME_LEADERBOARD = '''
+    CALL {
+        MATCH (u:User)
+        WHERE u.total_points IS NOT NULL
+        WITH u
+        ORDER BY u.total_points DESC
+        LIMIT $limit
+        RETURN u, u.total_points as points,
+               COALESCE(u.total_completions,
+                        COUNT { (u)-[:COMPLETED]->(:Concept) }) as completions
+      UNION ALL
+        MATCH (u:User)
+        WHERE u.total_points IS NULL
+        WITH u, COALESCE(u.total_completions,
+                         COUNT { (u)-[:COMPLETED]->(:Concept) }) as completions
+        ORDER BY completions DESC
+        LIMIT $limit
+        RETURN u, 0 as points, completions
+    }
+    RETURN u.name as name, u.id as user_id, completions,
+           points, u.avatar as avatar, u.level as level
+    ORDER BY points DESC, completions DESC
+    LIMIT $limit
+'''
+
+# weekly_points restarts whenever the ISO week stamped in points_week rolls over
+_Q_CREDIT_POINTS = '''
+    MATCH (u:User {id: $user_id})
+    WITH u, date().weekYear * 100 + date().week AS week
+    SET u.total_points = COALESCE(u.total_points, 0) + $delta,
+        u.weekly_points = CASE WHEN u.points_week = week
+                               THEN COALESCE(u.weekly_points, 0) ELSE 0 END + $delta,
+        u.points_week = week
+    FOREACH (award IN $awards |
+        CREATE (u)-[:EARNED_POINTS {
+            points: award.points,
+            reason: award.reason,
+            timestamp: datetime()
+        }]->(:PointAward)
+    )
+    FOREACH (achievement IN $achievements |
+        CREATE (u)-[:EARNED]->(:Achievement {
+            achievement_id: achievement.id,
+            name: achievement.name,
+            description: achievement.description,
+            points: achievement.points,
+            earned_at: datetime()
+        })
+    )
+    RETURN u.total_points as total_points
+'''
+
+# Points needed to reach levels 1..100, so common totals skip the square root
+_LEVEL_THRESHOLDS = [((level - 1) ** 2) * 100 for level in range(1, 101)]
 
 class GamificationEngine:
     def __init__(self, db):
         self.db = db
-        self.achievements = self._load_achievements()
-        self.skill_trees = self._load_skill_trees()
+        self.achievements = _ACHIEVEMENTS
+        self.skill_trees = _SKILL_TREES
         
-    def _load_achievements(self) -> Dict[str, Dict]:
-        """Load achievement definitions"""
-        return {
-            'first_steps': {
-                'name': '🚀 First Steps',
-                'description': 'Complete your first concept',
-                'points': 100,
-                'type': 'milestone',
-                'condition': lambda stats: stats['concepts_completed'] >= 1
-            },
-            'speed_demon': {
-                'name': '⚡ Speed Demon',
-                'description': 'Complete 3 concepts in one day',
-                'points': 250,
-                'type': 'performance',
-                'condition': lambda stats: stats['concepts_today'] >= 3
-            },
-            'perfectionist': {
-                'name': '💎 Perfectionist',
-                'description': 'Complete 5 concepts with 100% accuracy',
-                'points': 500,
-                'type': 'mastery',
-                'condition': lambda stats: stats['perfect_completions'] >= 5
-            },
-            'knowledge_seeker': {
-                'name': '🔍 Knowledge Seeker',
-                'description': 'Complete 10 concepts',
-                'points': 300,
-                'type': 'milestone',
-                'condition': lambda stats: stats['concepts_completed'] >= 10
-            },
-            'master_learner': {
-                'name': '🎓 Master Learner',
-                'description': 'Complete all concepts in a difficulty level',
-                'points': 1000,
-                'type': 'mastery',
-                'condition': lambda stats: stats['difficulty_mastered'] > 0
-            },
-            'streak_master': {
-                'name': '🔥 Streak Master',
-                'description': 'Maintain a 7-day learning streak',
-                'points': 750,
-                'type': 'consistency',
-                'condition': lambda stats: stats['current_streak'] >= 7
-            },
-            'collaboration_champion': {
-                'name': '🤝 Collaboration Champion',
-                'description': 'Help 5 other learners',
-                'points': 400,
-                'type': 'social',
-                'condition': lambda stats: stats['helped_others'] >= 5
-            },
-            'ai_whisperer': {
-                'name': '🤖 AI Whisperer',
-                'description': 'Use AI recommendations 10 times',
-                'points': 200,
-                'type': 'engagement',
-                'condition': lambda stats: stats['ai_interactions'] >= 10
-            }
-        }
-    
-    def _load_skill_trees(self) -> Dict[str, Dict]:
-        """Load skill tree definitions"""
-        return {
-            'statistics_fundamentals': {
-                'name': 'Statistics Fundamentals',
-                'icon': '📊',
-                'levels': [
-                    {'name': 'Novice', 'required_points': 0, 'bonus': 'Basic progress tracking'},
-                    {'name': 'Apprentice', 'required_points': 500, 'bonus': '+10% XP for beginner concepts'},
-                    {'name': 'Practitioner', 'required_points': 1500, 'bonus': 'Unlock advanced hints'},
-                    {'name': 'Expert', 'required_points': 3000, 'bonus': '+20% XP for all concepts'},
-                    {'name': 'Master', 'required_points': 5000, 'bonus': 'Unlock teaching mode'}
-                ]
-            },
-            'learning_efficiency': {
-                'name': 'Learning Efficiency',
-                'icon': '⚡',
-                'levels': [
-                    {'name': 'Beginner', 'required_points': 0, 'bonus': 'Standard learning speed'},
-                    {'name': 'Focused', 'required_points': 300, 'bonus': 'Reduced distraction penalties'},
-                    {'name': 'Optimized', 'required_points': 800, 'bonus': 'AI-powered study recommendations'},
-                    {'name': 'Accelerated', 'required_points': 2000, 'bonus': 'Fast-track learning paths'},
-                    {'name': 'Transcendent', 'required_points': 4000, 'bonus': 'Instant mastery detection'}
-                ]
-            },
-            'collaboration_master': {
-                'name': 'Collaboration Master',
-                'icon': '🤝',
-                'levels': [
-                    {'name': 'Solo', 'required_points': 0, 'bonus': 'Individual learning only'},
-                    {'name': 'Helper', 'required_points': 200, 'bonus': 'Can assist other learners'},
-                    {'name': 'Mentor', 'required_points': 600, 'bonus': 'Unlock group study sessions'},
-                    {'name': 'Leader', 'required_points': 1200, 'bonus': 'Create learning communities'},
-                    {'name': 'Guru', 'required_points': 2500, 'bonus': 'Global leaderboard access'}
-                ]
-            }
-        }
-    
     def get_user_stats(self, user_id: str) -> Dict[str, Any]:
         """Get comprehensive user statistics for gamification"""
         
-        # Get basic completion stats
-        basic_stats = self.db.execute_query('''
-            MATCH (u:User {id: $user_id})
-            OPTIONAL MATCH (u)-[c:COMPLETED]->(concept:Concept)
-            OPTIONAL MATCH (u)-[h:HELPED]->(other:User)
-            OPTIONAL MATCH (u)-[ai:AI_INTERACTION]->()
-            RETURN 
-                COUNT(DISTINCT concept) as concepts_completed,
-                COUNT(DISTINCT h) as helped_others,
-                COUNT(DISTINCT ai) as ai_interactions,
-                u.total_points as total_points,
-                u.current_streak as current_streak
-        ''', {'user_id': user_id})
+        stats = self._load_stats(user_id)
+        stats.pop('earned_ids')
+        return stats
+    
+    def _load_stats(self, user_id: str) -> Dict[str, Any]:
+        """get_user_stats plus earned_ids, the achievements the user already holds"""
+        
+        basic_stats = self.db.execute_read(_Q_USER_STATS, {'user_id': user_id})
         
         if not basic_stats:
             return self._default_user_stats()
         
         stats = basic_stats[0]
         
-        # Get today's completions
-        today_stats = self.db.execute_query('''
-            MATCH (u:User {id: $user_id})-[c:COMPLETED]->(concept:Concept)
-            WHERE date(c.timestamp) = date()
-            RETURN COUNT(*) as concepts_today
-        ''', {'user_id': user_id})
-        
-        stats['concepts_today'] = today_stats[0]['concepts_today'] if today_stats else 0
-        
-        # Get perfect completions
-        perfect_stats = self.db.execute_query('''
-            MATCH (u:User {id: $user_id})-[c:COMPLETED]->(concept:Concept)
-            WHERE c.accuracy >= 1.0
-            RETURN COUNT(*) as perfect_completions
-        ''', {'user_id': user_id})
-        
-        stats['perfect_completions'] = perfect_stats[0]['perfect_completions'] if perfect_stats else 0
-        
-        # Check difficulty mastery
-        mastery_stats = self.db.execute_query('''
-            MATCH (concept:Concept)
-            WITH concept.difficulty as difficulty, COUNT(*) as total_concepts
-            MATCH (u:User {id: $user_id})-[:COMPLETED]->(c:Concept {difficulty: difficulty})
-            WITH difficulty, total_concepts, COUNT(*) as completed_concepts
-            WHERE completed_concepts = total_concepts
-            RETURN COUNT(*) as difficulty_mastered
-        ''', {'user_id': user_id})
-        
-        stats['difficulty_mastered'] = mastery_stats[0]['difficulty_mastered'] if mastery_stats else 0
-        
         # Calculate level and XP
-        total_points = stats.get('total_points', 0) or 0
-        level_info = self._calculate_level(total_points)
+        level_info = self._calculate_level(stats['total_points'])
         stats.update(level_info)
         
         return dict(stats)
     
-    def check_achievements(self, user_id: str) -> List[Dict[str, Any]]:
-        """Check and award new achievements"""
+    def check_achievements(self, user_id: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Check and award new achievements, returning them with the user's updated stats"""
         
-        stats = self.get_user_stats(user_id)
-        
-        # Get user's current achievements
-        current_achievements = self.db.execute_query('''
-            MATCH (u:User {id: $user_id})-[:EARNED]->(a:Achievement)
-            RETURN a.achievement_id as id
-        ''', {'user_id': user_id})
+        stats = self._load_stats(user_id)
         
-        earned_ids = {a['id'] for a in current_achievements}
+        # The stats query already lists the user's current achievements
+        earned_ids = set(stats.pop('earned_ids'))
         new_achievements = []
         
-        for achievement_id, achievement in self.achievements.items():
-            if achievement_id not in earned_ids:
-                if achievement['condition'](stats):
-                    # Award achievement
-                    self._award_achievement(user_id, achievement_id, achievement)
-                    new_achievements.append({
-                        'id': achievement_id,
-                        'name': achievement['name'],
-                        'description': achievement['description'],
-                        'points': achievement['points']
-                    })
-        
-        return new_achievements
+        for achievement_id, stat, threshold in _ACHIEVEMENT_RULES:
+            if achievement_id not in earned_ids and stats[stat] >= threshold:
+                achievement = self.achievements[achievement_id]
+                new_achievements.append({
+                    'id': achievement_id,
+                    'name': achievement['name'],
+                    'description': achievement['description'],
+                    'points': achievement['points']
+                })
+        
+        # Record every new achievement and credit its points with one write
+        if new_achievements:
+            stats['total_points'] = self._credit_points(user_id, [
+                (a['points'], f"Achievement: {a['name']}") for a in new_achievements
+            ], new_achievements)
+            stats.update(self._calculate_level(stats['total_points']))
+        
+        return new_achievements, stats
     
-    def get_leaderboard(self, timeframe: str = 'all_time') -> List[Dict[str, Any]]:
+    def get_leaderboard(self, timeframe: str = 'all_time', limit: int = 10) -> List[Dict[str, Any]]:
         """Get leaderboard data"""
         
         if timeframe == 'weekly':
-            query = '''
-                MATCH (u:User)-[c:COMPLETED]->(concept:Concept)
-                WHERE c.timestamp >= datetime() - duration('P7D')
-                WITH u, COUNT(*) as weekly_completions, SUM(c.points) as weekly_points
-                RETURN u.name as name, u.id as user_id, weekly_completions as completions, 
-                       weekly_points as points, u.avatar as avatar
-                ORDER BY weekly_points DESC, weekly_completions DESC
-                LIMIT 10
-            '''
+            query = _Q_WEEKLY_LEADERBOARD
         else:
-            query = '''
-                MATCH (u:User)
-                OPTIONAL MATCH (u)-[c:COMPLETED]->(concept:Concept)
-                WITH u, COUNT(c) as total_completions, COALESCE(u.total_points, 0) as total_points
-                RETURN u.name as name, u.id as user_id, total_completions as completions,
-                       total_points as points, u.avatar as avatar, u.level as level
-                ORDER BY total_points DESC, total_completions DESC
-                LIMIT 10
-            '''
+            query = _Q_ALL_TIME_LEADERBOARD
         
-        return self.db.execute_query(query)
+        # Every dashboard polls this aggregation; a minute of staleness is fine
+        return self.db.cached_query(query, {'limit': limit}, ttl=60, tag='leaderboard')
     
     def get_skill_tree_progress(self, user_id: str) -> Dict[str, Any]:
         """Get user's skill tree progress"""
@@ -232,12 +295,7 @@ class GamificationEngine:
         
         progress = {}
         for tree_id, tree in self.skill_trees.items():
-            current_level = 0
-            for i, level in enumerate(tree['levels']):
-                if total_points >= level['required_points']:
-                    current_level = i
-                else:
-                    break
+            current_level = max(bisect.bisect_right(_SKILL_TREE_THRESHOLDS[tree_id], total_points) - 1, 0)
             
             next_level = current_level + 1 if current_level < len(tree['levels']) - 1 else None
             
@@ -258,28 +316,12 @@ class GamificationEngine:
     def award_points(self, user_id: str, points: int, reason: str) -> Dict[str, Any]:
         """Award points to user and update level"""
         
-        # Update user points
-        self.db.execute_query('''
-            MATCH (u:User {id: $user_id})
-            SET u.total_points = COALESCE(u.total_points, 0) + $points
-            RETURN u.total_points as new_total
-        ''', {'user_id': user_id, 'points': points})
-        
-        # Log the point award
-        self.db.execute_query('''
-            MATCH (u:User {id: $user_id})
-            CREATE (u)-[:EARNED_POINTS {
-                points: $points,
-                reason: $reason,
-                timestamp: datetime()
-            }]->(:PointAward)
-        ''', {'user_id': user_id, 'points': points, 'reason': reason})
+        # Update user points and log the award
+        self._credit_points(user_id, [(points, reason)])
         
-        # Check for new achievements
-        new_achievements = self.check_achievements(user_id)
-        
-        # Update level
-        stats = self.get_user_stats(user_id)
+        # Check for new achievements; the stats it loads already include
+        # the points above and the achievements it credits
+        new_achievements, stats = self.check_achievements(user_id)
         
         return {
             'points_awarded': points,
@@ -299,6 +341,7 @@ class GamificationEngine:
             'total_points': 0,
             'current_streak': 0,
             'difficulty_mastered': 0,
+            'earned_ids': [],
             'level': 1,
             'xp': 0,
             'xp_to_next_level': 100
@@ -308,7 +351,11 @@ class GamificationEngine:
         """Calculate level and XP from total points"""
         
         # Level formula: level = floor(sqrt(points / 100)) + 1
-        level = int((total_points / 100) ** 0.5) + 1
+        total_points = max(total_points, 0)
+        if total_points < _LEVEL_THRESHOLDS[-1]:
+            level = bisect.bisect_right(_LEVEL_THRESHOLDS, total_points)
+        else:
+            level = math.isqrt(int(total_points) // 100) + 1
         
         # XP within current level
         points_for_current_level = ((level - 1) ** 2) * 100
@@ -323,29 +370,23 @@ class GamificationEngine:
             'xp_to_next_level': max(xp_to_next_level, 0)
         }
     
-    def _award_achievement(self, user_id: str, achievement_id: str, achievement: Dict):
-        """Award achievement to user"""
+    def _credit_points(self, user_id: str, awards: List[tuple],
+                       achievements: List[Dict[str, Any]] = ()) -> int:
+        """Add (points, reason) awards to the user's totals, log each one and
+        record any newly earned achievements, all in one write.
+        
+        Write-only: it must not call award_points or check_achievements,
+        which would re-run the achievement checks once per award.
+        """
         
-        self.db.execute_query('''
-            MATCH (u:User {id: $user_id})
-            CREATE (a:Achievement {
-                achievement_id: $achievement_id,
-                name: $name,
-                description: $description,
-                points: $points,
-                earned_at: datetime()
-            })
-            CREATE (u)-[:EARNED]->(a)
-        ''', {
+        result = self.db.execute_write(_Q_CREDIT_POINTS, {
             'user_id': user_id,
-            'achievement_id': achievement_id,
-            'name': achievement['name'],
-            'description': achievement['description'],
-            'points': achievement['points']
+            'delta': sum(points for points, _ in awards),
+            'awards': [{'points': points, 'reason': reason} for points, reason in awards],
+            'achievements': list(achievements)
         })
         
-        # Award points
-        self.award_points(user_id, achievement['points'], f"Achievement: {achievement['name']}")
+        return result[0]['total_points'] if result else 0
     
     def _calculate_progress_to_next_level(self, total_points: int, levels: List[Dict], current_level: int) -> float:
         """Calculate progress percentage to next level"""
@@ -1,6 +1,88 @@
 import bcrypt
+import hashlib
+import hmac
+import os
+import threading
 import uuid
+from cachetools import TTLCache
+from functools import lru_cache
 from typing import Optional, Dict, Any
+from app.models.ai_engine import AILearningEngine
+
+# bcrypt work factor for new hashes; each step doubles the cost of a login
+# (12 is roughly 250ms of CPU). Existing hashes keep the cost they were made with.
+_BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+
+# Successful bcrypt checks keyed by (stored hash, HMAC of the password under a
+# random per-process key). Only matches are cached and neither the plaintext
+# nor a bare digest of it is kept, so a leaked entry cannot be brute-forced at
+# sha256 speed; a password change stores a new hash, so stale entries can no
+# longer be hit.
+_verified = TTLCache(maxsize=1024, ttl=300)
+_verified_lock = threading.Lock()
+_verified_key = os.urandom(32)
+
+def _check_password(password: str, password_hash: str) -> bool:
+    """Whether password matches password_hash
+    
+    A hit answers without bcrypt, which is faster by design: only the right
+    password can hit, so the timing tells a caller nothing the result does
+    not. Every wrong password, and every unknown email through
+    _burn_password_check, still pays for a full hash.
+    """
+    key = (password_hash, hmac.new(_verified_key, password.encode('utf-8'), hashlib.sha256).digest())
+    with _verified_lock:
+        if key in _verified:
+            return True
+    
+    stored = password_hash.encode('utf-8')
+    if not hmac.compare_digest(bcrypt.hashpw(password.encode('utf-8'), stored), stored):
+        return False
+    with _verified_lock:
+        _verified[key] = True
+    return True
+
+@lru_cache(maxsize=1)
+def _dummy_hash() -> bytes:
+    return bcrypt.hashpw(b'dummy-password', bcrypt.gensalt(_BCRYPT_ROUNDS))
+
+def _burn_password_check(password: str):
+    # Unknown emails pay for one bcrypt hash too, so response time does not
+    # reveal whether an account exists
+    hmac.compare_digest(bcrypt.hashpw(password.encode('utf-8'), _dummy_hash()), _dummy_hash())
+
+# (user_id, concept_id) completions queued but not yet written
+_pending_completions = set()
+_pending_lock = threading.Lock()
+
+_Q_CREATE_USER = '''
+    CREATE (u:User {id: $user_id, email: $email, name: $name, password_hash: $password_hash})
+    RETURN u.id as id, u.email as email, u.name as name
+'''
+
+_Q_USER_BY_EMAIL = '''
+    MATCH (u:User {email: $email})
+    RETURN u.id as id, u.email as email, u.name as name, u.password_hash as password_hash
+'''
+
+_Q_USER_PROGRESS = '''
+    MATCH (u:User {id: $user_id})
+    RETURN COUNT { (u)-[:COMPLETED]->(:Concept) } as completed
+'''
+
+_Q_CONCEPT_COUNT = '''
+    MATCH (c:Concept)
+    RETURN count(c) as total
+'''
+
+_Q_MARK_COMPLETE = '''
+    MATCH (u:User {id: $user_id}), (c:Concept {id: $concept_id})
+    MERGE (u)-[r:COMPLETED]->(c)
+    ON CREATE SET r.timestamp = datetime(),
+                  u.total_completions = COALESCE(u.total_completions + 1,
+                                                 COUNT { (u)-[:COMPLETED]->(:Concept) })
+    SET c.completed = true
+'''
 
 class User:
     def __init__(self, db):
@@ -13,59 +95,71 @@ class User:
             raise ValueError("User already exists")
         
         # Hash password
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(_BCRYPT_ROUNDS)).decode('utf-8')
         user_id = str(uuid.uuid4())
         
         # Create user
-        query = '''
-            CREATE (u:User {id: $user_id, email: $email, name: $name, password_hash: $password_hash})
-            RETURN u.id as id, u.email as email, u.name as name
-        '''
-        result = self.db.execute_query(query, {
+        result = self.db.execute_write(_Q_CREATE_USER, {
             'user_id': user_id, 'email': email, 'name': name, 'password_hash': password_hash
         })
         
         return result[0] if result else None
     
     def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
-        query = '''
-            MATCH (u:User {email: $email})
-            RETURN u.id as id, u.email as email, u.name as name, u.password_hash as password_hash
-        '''
-        result = self.db.execute_query(query, {'email': email})
+        result = self.db.execute_read(_Q_USER_BY_EMAIL, {'email': email})
         return result[0] if result else None
     
     def verify_password(self, email: str, password: str) -> Optional[Dict[str, Any]]:
         user = self.get_user_by_email(email)
         if not user:
+            _burn_password_check(password)
             return None
         
-        if bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8')):
+        if _check_password(password, user['password_hash']):
             return {'id': user['id'], 'email': user['email'], 'name': user['name']}
         return None
     
     def get_user_progress(self, user_id: str) -> Dict[str, Any]:
-        query = '''
-            MATCH (u:User {id: $user_id})
-            OPTIONAL MATCH (u)-[p:COMPLETED]->(c:Concept)
-            WITH u, count(c) as completed
-            MATCH (total:Concept)
-            RETURN completed, count(total) as total
-        '''
-        result = self.db.execute_query(query, {'user_id': user_id})
+        result = self.db.execute_read(_Q_USER_PROGRESS, {'user_id': user_id})
         
         if result:
             completed = result[0]['completed']
-            total = result[0]['total']
+            # The course only changes when it is seeded, which drops this entry
+            counted = self.db.cached_query(_Q_CONCEPT_COUNT, ttl=300, tag='concept_count')
+            total = counted[0]['total'] if counted else 0
             percentage = (completed / total * 100) if total > 0 else 0
             return {'completed': completed, 'total': total, 'percentage': percentage}
         
         return {'completed': 0, 'total': 0, 'percentage': 0}
     
-    def mark_concept_complete(self, user_id: str, concept_id: str):
-        query = '''
-            MATCH (u:User {id: $user_id}), (c:Concept {id: $concept_id})
-            MERGE (u)-[:COMPLETED]->(c)
-            SET c.completed = true
-        '''
-        self.db.execute_query(query, {'user_id': user_id, 'concept_id': concept_id})
+    def mark_concept_complete_later(self, user_id: str, concept_id: str):
+        """Queue mark_concept_complete as a background write; repeats while one is pending are dropped
+        
+        The key stays pending while the write is retried, so a failed attempt
+        is not queued twice; once the retries give up it is released, so the
+        user completing the concept again queues a fresh write.
+        """
+        key = (user_id, concept_id)
+        with _pending_lock:
+            if key in _pending_completions:
+                return
+            _pending_completions.add(key)
+        
+        def release(error=None):
+            with _pending_lock:
+                _pending_completions.discard(key)
+            if error is not None:
+                print(f"❌ Lost completion of {concept_id} for user {user_id}: {error}")
+        
+        def complete():
+            self.mark_concept_complete(user_id, concept_id, raise_errors=True)
+            release()
+        
+        self.db.run_in_background(complete, on_give_up=release)
+    
+    def mark_concept_complete(self, user_id: str, concept_id: str, raise_errors: bool = False):
+        self.db.execute_write(_Q_MARK_COMPLETE, {'user_id': user_id, 'concept_id': concept_id},
+                              raise_errors=raise_errors)
+        self.db.invalidate_cache(user_id)
+        self.db.invalidate_cache('concepts')
+        AILearningEngine.invalidate(user_id)
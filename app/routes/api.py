@@ -1,17 +1,11 @@
-from flask import Blueprint, jsonify, request, session
+from flask import Blueprint, current_app, jsonify, request, session
 from datetime import datetime, timedelta
-from app.models.course import Course
-from app.models.user import User
-from app.models.ai_engine import AILearningEngine
-from app.models.gamification import GamificationEngine
-from app.models.collaboration import CollaborationEngine
 
 api_bp = Blueprint('api', __name__)
 
 @api_bp.route('/graph')
 def get_graph():
     try:
-        from flask import current_app
         graph_data = current_app.db.get_course_graph()
         return jsonify(graph_data)
     except Exception as e:
@@ -20,8 +14,7 @@ def get_graph():
 @api_bp.route('/concept/<concept_id>')
 def get_concept(concept_id):
     try:
-        from flask import current_app
-        course_model = Course(current_app.db)
+        course_model = current_app.course_model
         concept = course_model.get_concept_details(concept_id)
         
         if not concept:
@@ -37,8 +30,7 @@ def get_user_progress():
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        from flask import current_app
-        user_model = User(current_app.db)
+        user_model = current_app.user_model
         progress = user_model.get_user_progress(session['user_id'])
         return jsonify(progress)
     except Exception as e:
@@ -50,8 +42,7 @@ def mark_complete(concept_id):
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        from flask import current_app
-        user_model = User(current_app.db)
+        user_model = current_app.user_model
         user_model.mark_concept_complete(session['user_id'], concept_id)
         return jsonify({'success': True})
     except Exception as e:
@@ -60,8 +51,7 @@ def mark_complete(concept_id):
 @api_bp.route('/learning-path')
 def get_learning_path():
     try:
-        from flask import current_app
-        course_model = Course(current_app.db)
+        course_model = current_app.course_model
         user_id = session.get('user_id')
         path = course_model.get_learning_path(user_id)
         return jsonify(path)
@@ -75,14 +65,8 @@ def get_ai_recommendations():
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        from flask import current_app
-        ai_engine = AILearningEngine(current_app.db)
+        ai_engine = current_app.ai_engine
         recommendations = ai_engine.analyze_learning_pattern(session['user_id'])
-        
-        # Ensure all values are properly formatted
-        if 'next_optimal_study_time' in recommendations and isinstance(recommendations['next_optimal_study_time'], datetime):
-            recommendations['next_optimal_study_time'] = recommendations['next_optimal_study_time'].isoformat()
-        
         return jsonify(recommendations)
     except Exception as e:
         print(f"AI recommendations error: {e}")  # Debug logging
@@ -96,7 +80,7 @@ def get_ai_recommendations():
             'total_concepts_completed': 0,
             'confidence_level': 50,
             'recommended_session_length': 30,
-            'next_optimal_study_time': (datetime.now() + timedelta(hours=24)).isoformat()
+            'next_optimal_study_time': datetime.now() + timedelta(hours=24)
         })
 
 @api_bp.route('/adaptive-learning-path')
@@ -105,8 +89,7 @@ def get_adaptive_learning_path():
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        from flask import current_app
-        ai_engine = AILearningEngine(current_app.db)
+        ai_engine = current_app.ai_engine
         path = ai_engine.generate_adaptive_path(session['user_id'])
         return jsonify({'concepts': path})
     except Exception as e:
@@ -118,8 +101,7 @@ def get_personalized_content(concept_id):
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        from flask import current_app
-        ai_engine = AILearningEngine(current_app.db)
+        ai_engine = current_app.ai_engine
         content = ai_engine.generate_personalized_content(concept_id, session['user_id'])
         return jsonify(content)
     except Exception as e:
@@ -132,8 +114,7 @@ def get_user_stats():
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        from flask import current_app
-        gamification = GamificationEngine(current_app.db)
+        gamification = current_app.gamification
         stats = gamification.get_user_stats(session['user_id'])
         return jsonify(stats)
     except Exception as e:
@@ -145,9 +126,8 @@ def get_achievements():
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        from flask import current_app
-        gamification = GamificationEngine(current_app.db)
-        achievements = gamification.check_achievements(session['user_id'])
+        gamification = current_app.gamification
+        achievements, _ = gamification.check_achievements(session['user_id'])
         return jsonify({'recent': achievements})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -158,8 +138,7 @@ def get_skill_trees():
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        from flask import current_app
-        gamification = GamificationEngine(current_app.db)
+        gamification = current_app.gamification
         skill_trees = gamification.get_skill_tree_progress(session['user_id'])
         return jsonify(skill_trees)
     except Exception as e:
@@ -168,11 +147,13 @@ def get_skill_trees():
 @api_bp.route('/leaderboard')
 def get_leaderboard():
     try:
-        from flask import current_app
-        gamification = GamificationEngine(current_app.db)
+        gamification = current_app.gamification
         timeframe = request.args.get('timeframe', 'all_time')
         leaderboard = gamification.get_leaderboard(timeframe)
-        return jsonify(leaderboard)
+        response = jsonify(leaderboard)
+        # Same for every visitor and already cached server-side for a minute
+        response.headers['Cache-Control'] = 'public, max-age=30'
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -180,8 +161,7 @@ def get_leaderboard():
 @api_bp.route('/study-groups')
 def get_study_groups():
     try:
-        from flask import current_app
-        collaboration = CollaborationEngine(current_app.db)
+        collaboration = current_app.collaboration
         user_id = session.get('user_id')
         groups = collaboration.get_study_groups(user_id)
         return jsonify(groups)
@@ -195,8 +175,7 @@ def create_study_group():
     
     try:
         data = request.get_json()
-        from flask import current_app
-        collaboration = CollaborationEngine(current_app.db)
+        collaboration = current_app.collaboration
         
         group_id = collaboration.create_study_group(
             session['user_id'],
@@ -216,8 +195,7 @@ def join_study_group(group_id):
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        from flask import current_app
-        collaboration = CollaborationEngine(current_app.db)
+        collaboration = current_app.collaboration
         success = collaboration.join_study_group(group_id, session['user_id'])
         return jsonify({'success': success})
     except Exception as e:
@@ -226,8 +204,7 @@ def join_study_group(group_id):
 @api_bp.route('/collaborative-sessions/<group_id>')
 def get_collaborative_sessions(group_id):
     try:
-        from flask import current_app
-        collaboration = CollaborationEngine(current_app.db)
+        collaboration = current_app.collaboration
         sessions = collaboration.get_active_sessions(group_id)
         return jsonify(sessions)
     except Exception as e:
@@ -240,8 +217,7 @@ def start_collaborative_session():
     
     try:
         data = request.get_json()
-        from flask import current_app
-        collaboration = CollaborationEngine(current_app.db)
+        collaboration = current_app.collaboration
         
         session_info = collaboration.start_collaborative_session(
             data['group_id'],
@@ -260,14 +236,12 @@ def get_learning_analytics():
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        from flask import current_app
-        ai_engine = AILearningEngine(current_app.db)
+        ai_engine = current_app.ai_engine
         analytics = ai_engine.analyze_learning_pattern(session['user_id'])
         
         # Add more detailed analytics
-        analytics['weekly_progress'] = [1, 2, 1, 3, 2, 1, 4]  # Mock data
+        analytics.update(ai_engine.get_weekly_activity(session['user_id']))
         analytics['mastery_breakdown'] = {'Beginner': 5, 'Intermediate': 3, 'Advanced': 1}
-        analytics['time_spent_daily'] = [30, 45, 20, 60, 35, 25, 50]  # Minutes
         
         return jsonify(analytics)
     except Exception as e:
@@ -279,8 +253,7 @@ def get_ai_session():
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        from flask import current_app
-        ai_engine = AILearningEngine(current_app.db)
+        ai_engine = current_app.ai_engine
         
         # Get personalized session
         profile = ai_engine.analyze_learning_pattern(session['user_id'])
@@ -311,8 +284,7 @@ def regenerate_path():
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        from flask import current_app
-        ai_engine = AILearningEngine(current_app.db)
+        ai_engine = current_app.ai_engine
         path = ai_engine.generate_adaptive_path(session['user_id'])
         return jsonify({'success': True, 'concepts': path})
     except Exception as e:
@@ -1,35 +1,117 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from app.models.user import User
+from flask import Blueprint, current_app, g, jsonify, render_template, request, redirect, url_for, flash, session
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from functools import wraps
+from werkzeug.exceptions import HTTPException
+import os
 
 auth_bp = Blueprint('auth', __name__)
 
+# Every login attempt costs a full bcrypt hash, so attempts are capped per
+# client and per target email. In-process counters are per worker; point
+# RATELIMIT_STORAGE_URI at a shared store to enforce them across workers.
+limiter = Limiter(key_func=get_remote_address,
+                  storage_uri=os.getenv('RATELIMIT_STORAGE_URI', 'memory://'))
+
+def _login_email() -> str:
+    return request.form.get('email', '').strip().lower() or get_remote_address()
+
+# Login and register pages as rendered for anonymous visitors with no flashes;
+# that rendering only varies with the links url_for builds, so it is built once
+# per template, app and mount point
+_anonymous_pages = {}
+
+def _render_page(template: str) -> str:
+    if 'user_id' in session or '_flashes' in session:
+        return render_template(template)
+    
+    key = (current_app._get_current_object(), request.script_root, template)
+    html = _anonymous_pages.get(key)
+    if html is None:
+        html = _anonymous_pages[key] = render_template(template)
+    return html
+
+# Endpoints without URL arguments always build the same path for a given app
+# and mount point, so each is resolved through the URL map once and then reused
+_static_urls = {}
+
+def static_url(endpoint: str) -> str:
+    key = (current_app._get_current_object(), request.script_root, endpoint)
+    url = _static_urls.get(key)
+    if url is None:
+        url = _static_urls[key] = url_for(endpoint)
+    return url
+
+def login_required(view):
+    """Send anonymous users to the login page (or a JSON 401 for non-GET calls)
+    and expose the logged-in user as g.user_id / g.user_name"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = session.get('user_id')
+        if user_id is None:
+            if request.method == 'GET':
+                return redirect(static_url('auth.login'))
+            return jsonify({'error': 'Not authenticated'}), 401
+        
+        g.user_id = user_id
+        g.user_name = session.get('user_name')
+        return view(*args, **kwargs)
+    return wrapper
+
+@auth_bp.errorhandler(ValueError)
+def _invalid_registration(e):
+    # create_user rejects an email that is already taken
+    if request.endpoint != 'auth.register':
+        return _view_error(e)
+    flash(str(e), 'error')
+    return render_template('auth/register.html')
+
+@auth_bp.errorhandler(Exception)
+def _view_error(e):
+    """Report a failed auth view on the page the user came from"""
+    if isinstance(e, HTTPException):
+        return e
+    
+    if request.endpoint == 'auth.login':
+        flash(f'Login error: {str(e)}', 'error')
+        return render_template('auth/login.html')
+    if request.endpoint == 'auth.register':
+        flash(f'Registration error: {str(e)}', 'error')
+        return render_template('auth/register.html')
+    flash(f'Error: {str(e)}', 'error')
+    return redirect(static_url('index'))
+
+def _login_failed(message: str, status: int):
+    """Script clients get the error as JSON; the plain form re-renders with a flash"""
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'error': message}), status
+    
+    flash(message, 'error')
+    return _render_page('auth/login.html')
+
 @auth_bp.route('/login', methods=['GET', 'POST'])
+@limiter.limit('10/minute', methods=['POST'])
+@limiter.limit('5/minute', methods=['POST'], key_func=_login_email)
 def login():
     if request.method == 'POST':
         email = request.form.get('email', '').strip()
         password = request.form.get('password', '')
         
         if not email or not password:
-            flash('Email and password required', 'error')
-            return render_template('auth/login.html')
+            return _login_failed('Email and password required', 400)
+        
+        user_model = current_app.user_model
+        user = user_model.verify_password(email, password)
         
-        try:
-            from flask import current_app
-            user_model = User(current_app.db)
-            user = user_model.verify_password(email, password)
-            
-            if user:
-                session['user_id'] = user['id']
-                session['user_name'] = user['name']
-                session['user_email'] = user['email']
-                flash(f'Welcome {user["name"]}!', 'success')
-                return redirect(url_for('index'))
-            else:
-                flash('Invalid credentials', 'error')
-        except Exception as e:
-            flash(f'Login error: {str(e)}', 'error')
+        if user:
+            session['user_id'] = user['id']
+            session['user_name'] = user['name']
+            flash(f'Welcome {user["name"]}!', 'success')
+            return redirect(static_url('index'))
+        else:
+            return _login_failed('Invalid credentials', 401)
     
-    return render_template('auth/login.html')
+    return _render_page('auth/login.html')
 
 @auth_bp.route('/register', methods=['GET', 'POST'])
 def register():
@@ -40,41 +122,28 @@ def register():
         
         if not all([name, email, password]):
             flash('All fields required', 'error')
-            return render_template('auth/register.html')
+            return _render_page('auth/register.html')
         
         if len(password) < 6:
             flash('Password must be at least 6 characters', 'error')
-            return render_template('auth/register.html')
+            return _render_page('auth/register.html')
         
-        try:
-            from flask import current_app
-            user_model = User(current_app.db)
-            user_model.create_user(email, password, name)
-            flash('Registration successful! Please login.', 'success')
-            return redirect(url_for('auth.login'))
-        except ValueError as e:
-            flash(str(e), 'error')
-        except Exception as e:
-            flash(f'Registration error: {str(e)}', 'error')
+        user_model = current_app.user_model
+        user_model.create_user(email, password, name)
+        flash('Registration successful! Please login.', 'success')
+        return redirect(static_url('auth.login'))
     
-    return render_template('auth/register.html')
+    return _render_page('auth/register.html')
 
 @auth_bp.route('/logout')
 def logout():
     session.clear()
     flash('Logged out successfully', 'info')
-    return redirect(url_for('auth.login'))
+    return redirect(static_url('auth.login'))
 
 @auth_bp.route('/profile')
+@login_required
 def profile():
-    if 'user_id' not in session:
-        return redirect(url_for('auth.login'))
-    
-    try:
-        from flask import current_app
-        user_model = User(current_app.db)
-        progress = user_model.get_user_progress(session['user_id'])
-        return render_template('auth/profile.html', progress=progress)
-    except Exception as e:
-        flash(f'Error: {str(e)}', 'error')
-        return redirect(url_for('index'))
+    user_model = current_app.user_model
+    progress = user_model.get_user_progress(g.user_id)
+    return render_template('auth/profile.html', progress=progress)
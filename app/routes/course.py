@@ -1,63 +1,113 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
-from app.models.course import Course
-from app.models.user import User
+from flask import Blueprint, current_app, g, make_response, render_template, request, redirect, flash, jsonify, session
+from app.routes.auth import login_required, static_url
+from werkzeug.exceptions import HTTPException
+import hashlib
+import json
+import os
 
 course_bp = Blueprint('course', __name__)
 
+def _template_version() -> str:
+    """Digest of every template, so all workers of a deploy tag pages alike"""
+    root = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates')
+    digest = hashlib.sha1()
+    for folder, dirs, files in sorted(os.walk(root)):
+        for name in sorted(files):
+            path = os.path.join(folder, name)
+            digest.update(os.path.relpath(path, root).encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+# Templates only change on deploy, so their contents version the ETags
+_TEMPLATE_VERSION = _template_version()
+
+# Flask-Compress sends the tag back as "<etag>:<encoding>" on compressed responses
+_ENCODING_SUFFIXES = (':gzip', ':br', ':deflate', ':zstd')
+
+def _etag_matches(etag: str) -> bool:
+    tags = request.if_none_match
+    if tags.star_tag:
+        return True
+    
+    for tag in tags.as_set(include_weak=True):
+        for suffix in _ENCODING_SUFFIXES:
+            if tag.endswith(suffix):
+                tag = tag[:-len(suffix)]
+                break
+        if tag == etag:
+            return True
+    return False
+
+def _render_cached(template: str, etag_data, **context):
+    """Render a page with a private ETag, answering 304 when the browser's copy is current
+    
+    etag_data must cover everything the page shows besides the logged-in user.
+    """
+    if '_flashes' in session:
+        return render_template(template, **context)
+    
+    etag = hashlib.sha1(json.dumps(
+        [_TEMPLATE_VERSION, g.user_id, g.user_name, etag_data], default=str
+    ).encode('utf-8')).hexdigest()
+    if _etag_matches(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(render_template(template, **context))
+    
+    # Revalidate every time: a completion changes the page right away
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@course_bp.errorhandler(Exception)
+def _view_error(e):
+    """JSON error for API-style calls, otherwise flash and step back a page"""
+    if isinstance(e, HTTPException):
+        return e
+    
+    if request.method != 'GET':
+        return jsonify({'error': str(e)}), 500
+    if request.endpoint == 'course.course_list':
+        flash(f'Error loading courses: {str(e)}', 'error')
+        return redirect(static_url('index'))
+    flash(f'Error: {str(e)}', 'error')
+    return redirect(static_url('course.course_list'))
+
 @course_bp.route('/list')
+@login_required
 def course_list():
-    if 'user_id' not in session:
-        return redirect(url_for('auth.login'))
-    
-    try:
-        from flask import current_app
-        course_model = Course(current_app.db)
-        concepts = course_model.get_all_concepts()
-        return render_template('course/list.html', concepts=concepts)
-    except Exception as e:
-        flash(f'Error loading courses: {str(e)}', 'error')
-        return redirect(url_for('index'))
+    course_model = current_app.course_model
+    concepts = course_model.get_all_concepts_summary()
+    return _render_cached('course/list.html', concepts, concepts=concepts)
 
 @course_bp.route('/concept/<concept_id>')
+@login_required
 def concept_detail(concept_id):
-    if 'user_id' not in session:
-        return redirect(url_for('auth.login'))
-    
-    try:
-        from flask import current_app
-        course_model = Course(current_app.db)
-        
-        concept = course_model.get_concept_details(concept_id)
-        if not concept:
-            flash('Concept not found', 'error')
-            return redirect(url_for('course.course_list'))
-        
-        prerequisites = course_model.get_prerequisites(concept_id)
-        next_concepts = course_model.get_next_concepts(concept_id)
-        
-        return render_template('course/concept.html', 
-                             concept=concept,
-                             prerequisites=prerequisites, 
-                             next_concepts=next_concepts)
-    except Exception as e:
-        flash(f'Error: {str(e)}', 'error')
-        return redirect(url_for('course.course_list'))
+    course_model = current_app.course_model
+    
+    concept = course_model.get_concept_with_neighbors(concept_id)
+    if not concept:
+        flash('Concept not found', 'error')
+        return redirect(static_url('course.course_list'))
+    
+    prerequisites = concept.pop('prerequisites')
+    next_concepts = concept.pop('next_concepts')
+    
+    return render_template('course/concept.html', 
+                         concept=concept,
+                         prerequisites=prerequisites, 
+                         next_concepts=next_concepts)
 
 @course_bp.route('/concept/<concept_id>/complete', methods=['POST'])
+@login_required
 def complete_concept(concept_id):
-    if 'user_id' not in session:
-        return jsonify({'error': 'Not authenticated'}), 401
-    
-    try:
-        from flask import current_app
-        user_model = User(current_app.db)
-        user_model.mark_concept_complete(session['user_id'], concept_id)
-        return jsonify({'success': True})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    user_model = current_app.user_model
+    user_model.mark_concept_complete_later(g.user_id, concept_id)
+    return jsonify({'success': True, 'queued': True}), 202
 
 @course_bp.route('/graph')
+@login_required
 def course_graph():
-    if 'user_id' not in session:
-        return redirect(url_for('auth.login'))
-    return render_template('course/graph.html')
+    return _render_cached('course/graph.html', None)
@@ -0,0 +1,36 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from neo4j.time import DateTime
+
+from app.models.ai_engine import AILearningEngine
+
+
+class SecondsSinceTest(unittest.TestCase):
+    def test_neo4j_datetime(self):
+        # COMPLETED.timestamp is written with Cypher datetime(), which the driver returns as DateTime
+        three_days_ago = DateTime.from_native(datetime.now(timezone.utc) - timedelta(days=3))
+
+        elapsed = AILearningEngine._seconds_since(three_days_ago, datetime.now())
+
+        self.assertAlmostEqual(elapsed / 86400, 3, places=2)
+
+    def test_legacy_iso_string(self):
+        elapsed = AILearningEngine._seconds_since(
+            (datetime.now() - timedelta(days=2)).isoformat(), datetime.now()
+        )
+
+        self.assertAlmostEqual(elapsed / 86400, 2, places=2)
+
+    def test_retention_uses_real_timestamps(self):
+        engine = AILearningEngine(db=None)
+        three_days_ago = DateTime.from_native(datetime.now(timezone.utc) - timedelta(days=3))
+        summary = engine._summarize_history([{'attempts': 1, 'difficulty': 'Beginner',
+                                              'timestamp': three_days_ago}])
+
+        # A three-day-old completion decays as exp(-3/7), not the 0.8 used for unreadable timestamps
+        self.assertAlmostEqual(engine._calculate_retention_score(summary), 0.6514, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from neo4j.time import DateTime
+
+from app.models.collaboration import CollaborationEngine, _WriteBehind
+
+
+class FlakyDB:
+    """Fails the first `failures` writes, then records every batch"""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.written = []
+
+    def execute_write(self, query, parameters=None, raise_errors=False):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("Neo4j is down")
+        self.written.append((query, parameters['events']))
+        return []
+
+
+class WriteBehindTest(unittest.TestCase):
+    statements = {'questions': 'questions', 'answers': 'answers'}
+
+    def test_failed_batch_is_retried_in_order(self):
+        db = FlakyDB(failures=1)
+        writer = _WriteBehind(db, self.statements, max_delay=0.01)
+        writer.put('questions', {'question_id': 'q1'})
+        writer.put('answers', {'question_id': 'q1'})
+        writer.flush()
+
+        # The answers waited for the question they reference
+        self.assertEqual(db.written, [('questions', [{'question_id': 'q1'}]),
+                                      ('answers', [{'question_id': 'q1'}])])
+
+    def test_retries_are_capped(self):
+        db = FlakyDB(failures=5)
+        writer = _WriteBehind(db, self.statements, max_delay=0.01, max_attempts=3)
+        writer.put('questions', {'question_id': 'q1'})
+        writer.flush()
+
+        self.assertEqual(db.failures, 2)
+        self.assertEqual(db.written, [])
+
+
+class StoredSessionDB:
+    """Serves one active session whose note was written an hour ago"""
+
+    def __init__(self):
+        self.stored = DateTime.from_native(datetime.now(timezone.utc) - timedelta(hours=1))
+
+    def execute_single(self, query, parameters=None, write=False):
+        return {'notes': [{'id': 'n1', 'user_id': 'u1', 'content': 'Earlier', 'timestamp': self.stored}],
+                'questions': []}
+
+    def execute_write(self, query, parameters=None, raise_errors=False):
+        return []
+
+
+class SessionTimestampTest(unittest.TestCase):
+    def tearDown(self):
+        CollaborationEngine.active_sessions.pop('s1', None)
+
+    def test_loaded_and_new_content_sort_together(self):
+        engine = CollaborationEngine(StoredSessionDB())
+        engine.add_shared_note('s1', 'u2', 'Later')
+
+        notes = engine._session_state('s1')['shared_notes']
+        self.assertEqual([note['content'] for note in sorted(notes, key=lambda note: note['timestamp'])],
+                         ['Earlier', 'Later'])
+        self.assertTrue(all(isinstance(note['timestamp'], datetime) for note in notes))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import importlib.util
+import os
+import subprocess
+import sys
+import unittest
+
+from flask import template_rendered
+
+import app.models.database as database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeDB:
+    """Serves a fixed concept list in place of Neo4j"""
+
+    concepts = [{'id': 'counting', 'name': 'Counting & Combinatorics ' * 40,
+                 'difficulty': 'Beginner', 'completed': False}]
+
+    def ensure_indexes(self):
+        pass
+
+    def cached_query(self, query, parameters=None, ttl=30, tag=None):
+        return self.concepts
+
+
+def create_test_app():
+    original = database.get_db
+    database.get_db = FakeDB
+    try:
+        # app.py sits beside the app package, so load it by path
+        spec = importlib.util.spec_from_file_location('app_main', os.path.join(ROOT, 'app.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        app = module.create_app()
+    finally:
+        database.get_db = original
+    app.config['TESTING'] = True
+    return app
+
+
+class CourseListETagTest(unittest.TestCase):
+    def setUp(self):
+        self.app = create_test_app()
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = 'u1'
+            session['user_name'] = 'Ada'
+
+        self.rendered = []
+        template_rendered.connect(self._record, self.app)
+        self.addCleanup(template_rendered.disconnect, self._record, self.app)
+
+    def _record(self, sender, template, context, **extra):
+        self.rendered.append(template.name)
+
+    def test_gzip_revalidation_skips_render(self):
+        headers = {'Accept-Encoding': 'gzip'}
+        first = self.client.get('/course/list', headers=headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers['Content-Encoding'], 'gzip')
+        self.assertTrue(first.headers['ETag'].endswith(':gzip"'))
+        self.assertEqual(len(self.rendered), 1)
+
+        second = self.client.get('/course/list', headers={
+            **headers, 'If-None-Match': first.headers['ETag']
+        })
+
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(len(self.rendered), 1)
+
+    def test_plain_revalidation_skips_render(self):
+        first = self.client.get('/course/list')
+        second = self.client.get('/course/list', headers={'If-None-Match': first.headers['ETag']})
+
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(len(self.rendered), 1)
+
+
+class TemplateVersionTest(unittest.TestCase):
+    def test_workers_agree_on_the_version(self):
+        # Each gunicorn worker imports the routes on its own
+        versions = {
+            subprocess.run([sys.executable, '-c', 'import app.routes.course as c; print(c._TEMPLATE_VERSION)'],
+                           cwd=ROOT, capture_output=True, text=True, check=True).stdout
+            for _ in range(2)
+        }
+
+        self.assertEqual(len(versions), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+import app.models.database as database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Nothing listens here, so the driver never connects
+UNREACHABLE = {'NEO4J_URI': 'bolt://127.0.0.1:9'}
+
+
+def failing_write():
+    raise RuntimeError("Neo4j is down")
+
+
+class BackgroundWriteTest(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.dict(os.environ, UNREACHABLE):
+            self.db = database.Neo4jDB()
+        self.addCleanup(self.db.close)
+
+    def test_failing_write_does_not_hold_up_later_ones(self):
+        done = threading.Event()
+        self.db.run_in_background(failing_write)
+        self.db.run_in_background(done.set)
+
+        # The first write is still waiting to retry, the second runs right away
+        self.assertTrue(done.wait(0.4))
+
+    def test_retries_are_capped(self):
+        gave_up = threading.Event()
+        with mock.patch.object(database, '_BACKGROUND_ATTEMPTS', 2):
+            self.db.run_in_background(failing_write, on_give_up=lambda error: gave_up.set())
+            self.assertTrue(gave_up.wait(3))
+
+        self.assertEqual(len(self.db.dead_letters), 1)
+
+
+class BrokenSession:
+    def execute_write(self, work):
+        raise RuntimeError("Connection reset")
+
+    execute_read = execute_write
+
+    def close(self):
+        pass
+
+
+class ManagedQueryTest(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.dict(os.environ, UNREACHABLE):
+            self.db = database.Neo4jDB()
+        self.addCleanup(self.db.close)
+        self.db.driver = mock.Mock()
+        self.db.driver.session.return_value = BrokenSession()
+
+    def test_raised_write_discards_the_session(self):
+        with self.assertRaises(RuntimeError):
+            self.db.execute_write('CREATE (:Node)', raise_errors=True)
+
+        self.assertIsNone(self.db._local.session)
+
+    def test_single_write_runs_in_a_managed_write(self):
+        session = mock.Mock()
+        session.execute_write.return_value = {'id': 1}
+        self.db.driver.session.return_value = session
+
+        self.assertEqual(self.db.execute_single('CREATE (n) RETURN 1 as id', write=True), {'id': 1})
+        session.execute_write.assert_called_once()
+        session.run.assert_not_called()
+
+
+class ShutdownTest(unittest.TestCase):
+    def test_exit_with_a_write_still_queued(self):
+        script = (
+            "from app.models.database import Neo4jDB\n"
+            "def write():\n"
+            "    raise RuntimeError('Neo4j is down')\n"
+            "Neo4jDB().run_in_background(write)\n"
+        )
+        started = time.monotonic()
+        result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, env={**os.environ, **UNREACHABLE},
+                                capture_output=True, text=True, timeout=20)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertLess(time.monotonic() - started, database._BACKGROUND_FLUSH_SECONDS + 5)
+        self.assertIn('Background write dropped', result.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
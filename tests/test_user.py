@@ -0,0 +1,40 @@
+import hashlib
+import unittest
+from unittest import mock
+
+import bcrypt
+
+import app.models.user as user
+
+
+class CheckPasswordTest(unittest.TestCase):
+    def setUp(self):
+        self.hash = bcrypt.hashpw(b'correct horse', bcrypt.gensalt(4)).decode('utf-8')
+        user._verified.clear()
+        self.addCleanup(user._verified.clear)
+
+    def count_hashes(self, password):
+        with mock.patch.object(user.bcrypt, 'hashpw', wraps=bcrypt.hashpw) as hashpw:
+            matched = user._check_password(password, self.hash)
+        return matched, hashpw.call_count
+
+    def test_wrong_password_always_pays_for_bcrypt(self):
+        user._check_password('correct horse', self.hash)
+
+        for _ in range(2):
+            self.assertEqual(self.count_hashes('wrong horse'), (False, 1))
+
+    def test_only_a_remembered_match_skips_bcrypt(self):
+        # Faster by design: the shortcut is only reachable with the right password
+        self.assertEqual(self.count_hashes('correct horse'), (True, 1))
+        self.assertEqual(self.count_hashes('correct horse'), (True, 0))
+
+    def test_cache_keeps_no_bare_digest(self):
+        user._check_password('correct horse', self.hash)
+
+        digest = hashlib.sha256(b'correct horse').digest()
+        self.assertNotIn(digest, [key[1] for key in user._verified])
+
+
+if __name__ == '__main__':
+    unittest.main()